@@ -8,113 +8,74 @@ It depends on:
     - rental_scrape_clean.py
     - yelp_scrape_clean.py
     - myfuncs.py
+    - cache.py
+    - snapshot.py
+    - startup.py
+    - figures.py
+    - jobs.py
 """
-from dash.dependencies           import Input, Output, State
-from dash.exceptions             import PreventUpdate
-from myfuncs                     import * 
-import dash_core_components      as dcc
-import dash_html_components      as html
-import dash_bootstrap_components as dbc
-import dash_table                as dt
-import dash_table.FormatTemplate as FormatTemplate
-import pandas                    as pd
-import numpy                     as np
-import geopandas                 as gpd
-import plotly.express            as px
-import plotly.graph_objects      as go
-
-import dash
-import flask
-import os
-import datetime
-import pgeocode
-
-import window
-window.pop_window()
+from startup import StartupProfiler
+
+# measures the time spent in each stage of the startup (see startup.py)
+profiler = StartupProfiler()
+
+# plotly (the graphs, see figures.py) and folium (the maps) are imported the
+# first time they are used, so they don't slow down the startup
+with profiler.stage('import dash', kind = 'import'):
+    from dash.dependencies           import Input, Output, State
+    from dash.exceptions             import PreventUpdate
+    import dash_core_components      as dcc
+    import dash_html_components      as html
+    import dash_bootstrap_components as dbc
+    import dash_table                as dt
+    import dash_table.FormatTemplate as FormatTemplate
+    import dash
+    import flask
+    import json
+    import uuid
+    import os
+
+with profiler.stage('import pandas and numpy', kind = 'import'):
+    import pandas                    as pd
+    import numpy                     as np
+
+with profiler.stage('import app modules', kind = 'import'):
+    from myfuncs                     import * 
+    from cache                       import LRUCache, MapCache, SessionStore
+    from figures                     import *
+    from jobs                        import JobManager, JobLimitError
+    from snapshot                    import load_snapshot, memory_report
+    import window
+
+with profiler.stage('pop-up window', kind = 'wait'):
+    window.pop_window()
 
 if window.answer == 0:
-    import rental_scrape_clean
-    import yelp_scrape_clean
+    with profiler.stage('refresh data', kind = 'refresh'):
+        import rental_scrape_clean
+        import yelp_scrape_clean
 else:
     pass
 
 # path where files are stored
 path = '../cleaned-data/'
-# read the data
-nyc_ntas = gpd.read_file(path + 'nyc-TNA.geojson', driver = "GeoJSON")
-facilities_db = pd.read_csv(path + 'manhattan-surroundings_cleaned.csv', dtype = {'zipcode':str})
-facilities_db = facilities_db.drop_duplicates()
-crime_geom = pd.read_csv(path + 'manhattan-crime_cleaned.csv', parse_dates = ['datetime'])
-rental_df = pd.read_csv(path + 'manhattan-rental_cleaned.csv', dtype = {'zipcode':str})
-yelp_data = pd.read_csv(path + 'yelp-restaurants_cleaned.csv', dtype = {'Zipcode':str})
-
-# some data transformations for more convenience
-# --- rental data ---
-# create a dataframe with latitude and longitude for rental zipcodes
-zipcodes = list(rental_df['zipcode'].unique())
-nomi = pgeocode.Nominatim('us')
-zipcodes_lat_lon = nomi.query_postal_code(zipcodes)
-zipcodes_lat_lon = zipcodes_lat_lon[['postal_code', 'latitude', 'longitude']].rename(columns = {'postal_code':'zipcode'})
-
-# select all vars that refer to rental types
-rental_types = [col for col in rental_df if 'Bed' in col or 'Studio' in col]
-rental_types.sort()
-# change the dataframe format from wide to long
-rental_df = rental_df.melt(
-    id_vars = [col for col in rental_df if col not in rental_types], 
-    var_name = 'type', 
-    value_name = 'price'
-)
-# add a variable 'call for rent' when the rental price is not available
-rental_df['call_for_rent'] = rental_df['price'].apply(lambda x: 1 if x == 'Call for Rent' else 0)
-# change the price to float format
-rental_df['price'] = rental_df['price'].apply(lambda x: np.nan if x == 'Call for Rent' else x).astype(float)
-# remove rows where price is zero
-rental_df = rental_df[rental_df['price'] != 0]
-# append latitude and longitude
-rental_df = rental_df.merge(right = zipcodes_lat_lon, on = 'zipcode')
-# append ntacode and ntaname from shape file of NYC
-rental_df = gpd.GeoDataFrame(
-    rental_df, 
-    geometry = gpd.points_from_xy(
-        rental_df.longitude, 
-        rental_df.latitude
-        )
-)
-rental_df.crs = {'init': 'epsg:4326'}
-rental_df = gpd.sjoin(
-    left_df = rental_df, 
-    right_df = nyc_ntas[['geometry', 'ntacode', 'ntaname']], 
-    how = 'inner'
-)
-# select the columns that will be displayed in the datatable
-cols = ['ntaname', 'zipcode', 'name', 'address', 'contact', 'rating', 'type', 'price']
-df = rental_df[cols].sort_values(by = ['price', 'rating'], ascending = [True, False])
-
-# --- yelp data ---
-# remove duplicate columns
-yelp_data = yelp_data.drop(columns = ['Outdoor seating'])
-# remove duplicate rows
-yelp_data = yelp_data.drop_duplicates(subset = ['names'])
-# drop rows where the food type is na (about 2% of records)
-food_types = yelp_data.dropna(subset = ['food types'])
-# create a row for each food type
-food_types = pd.concat([pd.Series(row['names'], row['food types'].split(',')) for _, row in food_types.iterrows()])
-food_types = food_types.reset_index()
-# change the name of the columns
-food_types.columns = ['food type', 'names']
-# remove other characters
-food_types['food type'] = food_types['food type'].str.strip()
-# merge the food types with the original data
-# a new row for each restaurant will be created for each food typr
-yelp_data = yelp_data.merge(food_types, on = 'names')
-# keep only the address
-yelp_data['locations'] = yelp_data['locations'].apply(lambda x: x.split('\n')[0])
-# rename some columns
-yelp_data = yelp_data.rename(
-    columns = {'names':'restaurant name', 'locations': 'business address', 'ratings': 'rating'})
-# change all names to lowercase
-yelp_data.columns = yelp_data.columns.str.lower()
+# load the data, already transformed, from the serving snapshot
+# (it's rebuilt only if the data was refreshed, see snapshot.py)
+with profiler.stage('load snapshot', kind = 'data'):
+    snapshot = load_snapshot(path, rebuild = window.answer == 0)
+# the frames use compact dtypes (see snapshot.SCHEMA)
+memory_report(snapshot['memory'])
+rental_df = snapshot['rental_df']
+df = snapshot['df']
+rental_types = snapshot['rental_types']
+zipcodes_lat_lon = snapshot['zipcodes_lat_lon']
+facilities_db = snapshot['facilities_db']
+proximity_df = snapshot['proximity_df']
+# number of crimes by NTA, hour (or day) and category for the crime charts
+# (built with the snapshot, so the crimes themselves are not kept in memory)
+crime_cube = snapshot['crime_cube']
+crime_count = snapshot['crime_count']
+yelp_data = snapshot['yelp_data']
 
 # select the columns from Yelp data that will be used in the datatable
 yelp_cols = ['restaurant name', 
@@ -124,17 +85,51 @@ yelp_cols = ['restaurant name',
              'rating', 
              'outdoor seating', 
              'sit down dinning', 
-             'outdoor seating',
              'delivery']
 
-# create crime counts for plots
-crime_count = crime_geom.groupby(['ntaname', 'latitude', 'longitude']).size().to_frame('count').reset_index()
-crime_count = crime_count.sort_values(by = 'count', ascending = False).reset_index(drop = True)
-crime_count = crime_count.rename(columns = {'latitude':'lat', 'longitude':'lon'})
+with profiler.stage('build indexes', kind = 'data'):
+    # nearest crime location lookup by NTA
+    crime_index = CrimeIndex(crime_count)
+
+    # charts and table of restaurants by zipcode
+    yelp_store = YelpStore(yelp_data, columns = yelp_cols)
+
+    # index over rentals used to filter them by the user's choices
+    rental_index = RentalIndex(rental_df)
+
+# cache of distances and orderings by (zipcodes, ranking, miles). The data is
+# loaded once, when the app starts, so the caches are tied to the version of
+# that snapshot; data refreshed while the app runs is used after a restart
+version = snapshot['version']
+recommendation_cache = LRUCache(maxsize = 256)
+recommendation_cache.set_version(version)
+
+# generated maps, stored by their inputs
+map_cache = MapCache(path = './maps/cache/', max_files = 500)
+
+# intermediate results (filtered rentals and distances) of each session and query,
+# stored in a local folder shared by all the workers
+session_store = SessionStore(path = './state/sessions/', ttl = 30 * 60, max_entries = 256)
+
+# graphs of the results page, stored by zipcode or NTA
+figure_cache = FigureCache(maxsize = 512)
+figure_cache.set_version(version)
+
+# rows of the rentals table (all rentals and the results of each query),
+# served one page at a time
+table_views = LRUCache(maxsize = 64)
+table_views.set_version(version)
+
+# recommendations run in the background, one at a time by session (see jobs.py).
+# Jobs are stored in a local folder, so with several workers any of them can
+# answer the polls of a session
+jobs = JobManager(path = './state/jobs/', max_workers = 4, max_per_session = 1)
 
 # helpers
-zipcodes = sorted(list(rental_df['zipcode'].unique()))
-facilities = sorted(list(facilities_db['facgroup'].unique()))
+miles = 0.25 # walking distance
+rental_columns = ['ntaname', 'zipcode', 'name', 'address', 'contact', 'type', 'price']
+zipcodes = snapshot['zipcodes']
+facilities = snapshot['facilities']
 
 # authentication
 users = {'admin':'123456', 'user1':'xzbm-VEeLRTM~7)#'}
@@ -369,6 +364,11 @@ user_opts = dbc.Container(
             html.Br(),
             dbc.Button("Generate Recommendations", color = "primary", id = 'generate_button'),
 
+            # progress of the recommendation (see poll_recommendation)
+            dbc.Progress(id = 'job-progress', value = 0, striped = True, animated = True, style = {'display': 'none'}),
+            dcc.Interval(id = 'job-poll', interval = 500, disabled = True),
+            dcc.Store(id = 'job'),
+
             # no results alert
             html.Br(),
             html.Br(),
@@ -446,7 +446,7 @@ recommendations = dbc.Container([
                     html.Iframe(
                         id = 'map',
                         style = {'border': 'none', 'width': '100%', 'height': 350},
-                        srcDoc = open('./maps/NYC-map.html', 'r').read(),
+                        src = '/maps/NYC-map.html',
                     ),
 
                     html.Br(),
@@ -464,10 +464,14 @@ recommendations = dbc.Container([
                             {'name': 'Rental Type', 'id': 'type'},
                             {'name': 'Price ($)', 'id': 'price', 'type': 'numeric', 'format': FormatTemplate.money(0)}
                         ],
-                        data = df.to_dict('records'),
-                        filter_action = "native",
-                        sort_action = "native",
+                        # the rows are paged, sorted and filtered in the server (see update_table)
+                        page_action = "custom",
+                        page_current = 0,
+                        filter_action = "custom",
+                        filter_query = '',
+                        sort_action = "custom",
                         sort_mode = "multi",
+                        sort_by = [],
                         style_cell = {'fontSize': 12, 'font-family':'sans-serif'},
                         style_cell_conditional=[
                             {'if': {'column_id': c}, 'textAlign': 'left'} for c in ['name', 'address']
@@ -521,13 +525,16 @@ yelp = html.Div([
                             {'name': 'Rating', 'id': 'rating'},
                             {'name': 'Outdoor seating', 'id': 'outdoor seating'},
                             {'name': 'Sit down dinning', 'id': 'sit down dinning'},
-                            {'name': 'Outdoor seating', 'id': 'outdoor seating'},
                             {'name': 'Delivery', 'id': 'delivery'}
                         ],
-                        data = yelp_data.drop_duplicates(subset = 'restaurant name').to_dict('records'),
-                        filter_action = "native",
-                        sort_action = "native",
+                        # the rows are paged, sorted and filtered in the server (see update_yelp_table)
+                        page_action = "custom",
+                        page_current = 0,
+                        filter_action = "custom",
+                        filter_query = '',
+                        sort_action = "custom",
                         sort_mode = "multi",
+                        sort_by = [],
                         style_cell = {'fontSize': 12, 'font-family':'sans-serif'},
                         style_cell_conditional = [
                             {'if': {'column_id': c}, 'textAlign': 'left'} for c in ['restaurant name', 'business address']
@@ -577,7 +584,7 @@ crime = html.Div([
                     html.Iframe(
                         id = 'nta-map',
                         style = {'border': 'none', 'width': '100%', 'height': 300},
-                        srcDoc = open('./maps/nta_crime_count.html', 'r').read()
+                        src = '/maps/nta_crime_count.html'
                     )
                 ])
             ),
@@ -635,7 +642,10 @@ page_1 = html.Div([
         dbc.Col(crime, width = {'size': 12, 'offset': 0})
     ],
     className = 'content'
-    )   
+    ),
+
+    # result of the last recommendation, used to update the map and the graphs
+    dcc.Store(id = 'recommendation')
 ])
 
 # run the app
@@ -646,7 +656,76 @@ app.config["suppress_callback_exceptions"] = True
 app.css.config.serve_locally = False
 
 # active page
-app.layout = html.Div([dcc.Location(id = "url"), html.Div(id = "page-content")])  
+app.layout = html.Div([
+    dcc.Location(id = "url"), 
+    html.Div(id = "page-content"),
+    # id of the session, used to store its results in the server (see session_store)
+    dcc.Store(id = "session-id", storage_type = "session")
+    ])  
+
+# maps are served as cacheable pages, so the browser only downloads them once
+def map_response(html, etag, last_modified, max_age):
+    '''
+    Returns the html of a map with the headers used by the browser to cache it.
+    If the browser already has this version of the map, the response is empty
+    (304 Not Modified)
+    '''
+    response = flask.Response(html, mimetype = 'text/html')
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+
+    return response.make_conditional(flask.request)
+
+@server.route('/maps/<name>')
+def static_map(name):
+    '''
+    Serves the maps stored in ./maps/ (e.g. NYC-map.html)
+    '''
+    filename = os.path.join('./maps/', name)
+    if not name.endswith('.html') or os.path.basename(name) != name or not os.path.isfile(filename):
+        flask.abort(404)
+    stat = os.stat(filename)
+    with open(filename, 'r') as f:
+        html = f.read()
+
+    return map_response(html, '{}-{}'.format(stat.st_size, int(stat.st_mtime)), stat.st_mtime, 3600)
+
+@server.route('/maps/cache/<key>')
+def cached_map(key):
+    '''
+    Serves the maps generated for the recommendations. A map doesn't change
+    (its key is a hash of everything it depends on, see MapCache.key), but it's
+    cached by the browser for a day only, so a map stored under a wrong key
+    doesn't outlive the cache of the server. Then the browser revalidates it
+    with its ETag (the key)
+    '''
+    entry = map_cache.get_entry(key)
+    if entry is None:
+        flask.abort(404)
+    html, last_modified = entry
+
+    return map_response(html, key, last_modified, 24 * 3600)
+
+# the cache stats are only shown to the admin (HTTP basic authentication)
+@server.route('/cache-stats')
+def cache_stats():
+    '''
+    Returns the number of hits and misses (and the hit rate) of the caches
+    '''
+    auth = flask.request.authorization
+    if auth is None or auth.username != 'admin' or users.get('admin') != auth.password:
+        return flask.Response(
+            'Admin credentials are required', 401, {'WWW-Authenticate': 'Basic realm="MZM"'})
+
+    return flask.jsonify({
+        'recommendations': recommendation_cache.stats(),
+        'maps': map_cache.memory.stats(),
+        'figures': figure_cache.stats(),
+        'tables': table_views.stats(),
+        'sessions': {'size': len(session_store), 'bytes': session_store.nbytes()}
+        })
 
 # index cover
 @app.callback(
@@ -667,6 +746,18 @@ def index_validation(n_clicks, user, password):
     else: 
         return 'User does not exist. Check username and try again', dash.no_update
 
+# a new id for each browser session
+@app.callback(
+    Output("session-id", "data"),
+    Input("url", "pathname"),
+    State("session-id", "data")
+    )
+def assign_session(pathname, session):
+    if session is not None:
+        raise PreventUpdate
+
+    return uuid.uuid4().hex
+
 # navigation in the dashboard
 @app.callback(
     Output("page-content", "children"), 
@@ -678,46 +769,16 @@ def render_page_content(pathname):
     elif (pathname == "/recommendations"):
         return [side_nav, page_1]
 
-# update tables and graphs according to user inputs
-@app.callback(
-    [
-    Output('no-results-alert', 'is_open'),
-    Output('no-results-alert', 'children'),
-    Output('total_no_rentals', 'children'),
-    Output('selected_rentals', 'children'),
-    Output('avg-dist-first', 'children'),
-    Output('avg-dist-second', 'children'),
-    Output('avg-dist-third', 'children'),
-    Output('table', 'data'),
-    Output('map', 'srcDoc'),
-    Output('type-price-rating', 'figure'),
-    Output('food-types-bar', 'figure'),
-    Output('yelp-table', 'data'),
-    Output('price-histogram', 'figure'),
-    Output('price-type', 'figure'),
-    Output('crimes-by-hour', 'figure'),
-    Output('crimes-by-day', 'figure')
-    ],
-
-    [Input('generate_button', 'n_clicks')],
-
-    state = [
-        State('price_range', 'value'),
-        State('zipcodes', 'value'),
-        State('rental_types', 'value'),
-        State('laundry', 'value'),
-        State('parking', 'value'),
-        State('pets', 'value'),
-        State('facilities', 'value'),
-        State('facilities2', 'value'),
-        State('facilities3', 'value')
-        ]
-)
-
-def update_results(n_clicks, price_range, zipcodes, rental_types, laundry, parking, pets, first, second, third):
-    
-    if n_clicks is None:
-        raise PreventUpdate
+def recommend_rentals(price_range, zipcodes, rental_types, laundry, parking, pets, first, second, third, report = None):
+    '''
+    Filters the rentals based on the user's choices and ranks them.
+    Returns the rentals sorted from best to worst, the distances between their
+    zipcodes and the facilities, and the list of zipcodes ranked from best to worst
+    (the last two are None if there are no rentals with the selected features).
+    'report' is called with the name of each stage ('filter', 'distance' and
+    'order') when it finishes (see jobs.JobManager)
+    '''
+    report = report if report is not None else (lambda stage: None)
 
     filtered_df = filter_rentals(
         price_range, 
@@ -726,41 +787,41 @@ def update_results(n_clicks, price_range, zipcodes, rental_types, laundry, parki
         laundry, 
         parking, 
         pets,
-        df = rental_df
+        df = rental_df,
+        index = rental_index
     )
+    report('filter')
 
-    n_rentals, _ = filtered_df.shape
-    if n_rentals == 0:
-        return [
-            True, 'Oops! There are no rentals with the selected features. Please select other options and try again',
-            '{:,.0f}'.format(df.shape[0]), '0', 
-            '', '', '',
-            filtered_df.to_dict('records'), 
-            open('./maps/NYC-map.html', 'r').read(),
-            dash.no_update, dash.no_update,
-            yelp_data.drop_duplicates(subset = 'restaurant name').to_dict('records'),
-            dash.no_update, dash.no_update, dash.no_update, dash.no_update
-            ]
-
+    if filtered_df.shape[0] == 0:
+        return filtered_df, None, None
 
     ranks = {first: 1, second: 2, third: 3}
+    rental_zipcodes = tuple(sorted(filtered_df['zipcode'].unique()))
+
+    def recommend():
+        distances_df = query_proximity(
+            table = proximity_df,
+            facilities = facilities_db,
+            zipcodes = rental_zipcodes,
+            ranks = ranks,
+            miles = miles
+            )
+        report('distance')
+        return distances_df, get_ordering(distances_df, n_ranks = max(ranks.values()))
 
-    facilities = facilities_db[facilities_db['facgroup'].isin(ranks.keys())]
-
-    distances_df = compute_distances(
-        rentals = filtered_df, 
-        facilities = facilities, 
-        ranks = ranks
+    distances_df, rentals_rank = recommendation_cache.get_or_compute(
+        key = (rental_zipcodes, (first, second, third), miles),
+        func = recommend
         )
-
-    rentals_rank = get_ordering(distances_df)
     rentals_rank_d = {k:v for v, k in enumerate(rentals_rank)}
-    filtered_df['zipcode_order'] = filtered_df['zipcode'].map(rentals_rank_d)
+    # listings only have the coordinates of the centroid of their zipcode (see
+    # snapshot.build_snapshot), so they are ranked by the ranking of their zipcode
+    filtered_df['zipcode_order'] = filtered_df['zipcode'].map(rentals_rank_d).astype(float)
     
-    filtered_df = filtered_df.merge(crime_count, on = 'ntaname')
-    filtered_df['distance'] = filtered_df.apply(
-        lambda x: distance(x['latitude'], x['longitude'], x['lat'], x['lon']), axis = 1) 
-    filtered_df = filtered_df.sort_values(by = ['distance', 'count'])
+    # the nearest crime location (and its number of crimes) for every listing
+    filtered_df = filtered_df.join(crime_index.nearest(filtered_df))
+    filtered_df = filtered_df.dropna(subset = ['count'])
+    filtered_df = filtered_df.sort_values(by = ['distance', 'count'], kind = 'mergesort')
     filtered_df = filtered_df.drop_duplicates(subset = ['name', 'address'], keep = 'first')
     
     filtered_df = filtered_df.sort_values(
@@ -768,225 +829,62 @@ def update_results(n_clicks, price_range, zipcodes, rental_types, laundry, parki
         ascending = [True, True, True, False]
         ).reset_index(drop = True)
     
-    cols = ['index_right', 'geometry', 'lat', 'lon', 'distance', 'count', 'zipcode_order']
+    cols = ['lat', 'lon', 'distance', 'count', 'zipcode_order']
     filtered_df = pd.DataFrame(filtered_df.drop(columns = cols))
-    
-    current_time = datetime.datetime.now().date()
-    
-    all_facilities = set(distances_df['facgroup'])
-    top_three = ''.join([x[:4] for x in all_facilities])
-    
-    path = './maps/' + str(current_time) + '_' + rentals_rank[0] + '-' +  top_three  + '.html'
-    # path = './maps/' + str(current_time) + '_' + rentals_rank[0] + '.html'
-    
-    if not os.path.isfile(path):
-        save_map(
-            filtered_df,
-            distances_df,
-            best_zipcode = rentals_rank[0]
-        )
-    
-    # --- plots ---
-    # yelp plots
-    yelp_data_ = yelp_data[yelp_data['zipcode'] == rentals_rank[0]].sort_values(by = 'rating', ascending = False)
-
-    top_food_types = yelp_data_['food type'].value_counts(normalize = True)[:15].index.to_list()
-    type_price_rating = yelp_data_[yelp_data_['food type'].isin(top_food_types)].reset_index(drop = True)
-    type_price_rating = type_price_rating[['food type', 'price level', 'num_rating', 'rating']]
-    type_price_rating = (
-        type_price_rating
-        .groupby(
-            ['food type', 'price level'], 
-            as_index = False)[['num_rating', 'rating']]
-        .agg('mean')
-    )
 
-    colors_d = {'$':'#ade8f4', '$$':'#48cae4', '$$$':'#0096c7', '$$$$':'#03045e'}
-    
-    fig5 = px.scatter(
-        type_price_rating, 
-        x = "food type", 
-        y = "rating",
-        size = "num_rating", 
-        color = "price level",
-        size_max = 40,
-        hover_data = {'rating': ':.2f', 'num_rating': ':,.0f'},
-        color_discrete_map = colors_d
-    )
+    report('order')
 
-    fig5.update_xaxes(tickangle = 45)
+    return filtered_df, distances_df, rentals_rank
 
-    fig5.update_layout(
-        showlegend = False,
-        xaxis_title = 'Food Type (top 15)',
-        yaxis_title = 'Average Rating',
-        height = 380,
-        margin = dict(l = 10, r = 10, t = 50, b = 10)
-    )
+# stages of a recommendation, in the order they run
+RECOMMENDATION_STAGES = ['filter', 'distance', 'order', 'render map', 'figures']
 
-    food_types_count = (
-        yelp_data_['food type']
-        .value_counts(normalize = True)[:25]
-        .to_frame()
-        .reset_index()
-    )
-    food_types_count.columns = ['food type', 'pct']
-    n_max = food_types_count.pct.max()
-    
-    fig6 = px.bar(
-        food_types_count, 
-        y = 'pct', 
-        x = 'food type', 
-        text = 'pct',
-        hover_data = {'pct': ':.2f'}
-    )
-    fig6.update_traces(texttemplate = '%{text:%.2f}', textposition = 'outside')
-    fig6.update_yaxes(visible = True, showticklabels = False)
-    fig6.update_layout(
-        title = 'Most popular food types in zipcode ' + rentals_rank[0],
-        yaxis_title = 'Relative frequency (%)',
-        yaxis = {'range':[0, n_max + .01]},
-        uniformtext_minsize = 6,
-        uniformtext_mode = 'hide',
-        height = 400,
-        margin = dict(l = 10, r = 10, t = 50, b = 10)
-    )
-    
-    # rental prices
-    nta = str(filtered_df['ntaname'][0])
-    prices_data = rental_df[rental_df['ntaname'] == nta]
-    colors = ['#4cc9f0', '#4361ee', '#3a0ca3', '#560bad', '#7209b7', '#f72585']
-    
-    fig3 = px.histogram(
-        prices_data, 
-        x = 'price',
-        nbins = 15,
-        title = 'Distribution of Prices',
-        color_discrete_sequence = [colors[-1]],
-        labels = {'price':'$','count':'no. of rentals'},
-        height = 300
-        )
-    
-    fig3.update_layout(
-        yaxis_title = "No. of Rentals",
-        xaxis_title = 'Price (USD Dollars)',
-        margin = dict(l = 20, r = 20, t = 50, b = 20),
-        showlegend = False, 
-        title_x = 0.5,
-        height = 300
-        )
-        
-    fig4 = px.box(
-        prices_data, 
-        x = 'type', 
-        y = 'price')
-
-    fig4.update_layout(
-        title_text = 'Distribution of Prices by Rental Type in ' + nta,
-        yaxis_title = 'Price (USD Dollars)',
-        xaxis_title = 'Type of Rental',
-        height = 300
-        )
+# outputs of a recommendation
+RECOMMENDATION_OUTPUTS = [
+    Output('no-results-alert', 'is_open'),
+    Output('no-results-alert', 'children'),
+    Output('total_no_rentals', 'children'),
+    Output('selected_rentals', 'children'),
+    Output('avg-dist-first', 'children'),
+    Output('avg-dist-second', 'children'),
+    Output('avg-dist-third', 'children'),
+    Output('recommendation', 'data')
+    ]
 
-    # crime rates by hour
-    nta_crimes = crime_geom[crime_geom['ntaname'] == nta]
-    nta_crimes_count = (
-        nta_crimes
-        .groupby(
-            [nta_crimes['datetime'].dt.hour, 'law_cat_cd'], 
-            as_index = False)
-        .size()
-        )
-    felony = nta_crimes_count[nta_crimes_count['law_cat_cd'] == 'FELONY']
-    misdemeanor = nta_crimes_count[nta_crimes_count['law_cat_cd'] == 'MISDEMEANOR']
-    violation = nta_crimes_count[nta_crimes_count['law_cat_cd'] == 'VIOLATION']
-
-    fig = go.Figure()
-    fig.add_trace(go.Bar(
-        x = felony['datetime'], 
-        y = felony['size'], 
-        name = 'Felony',
-        marker_color = '#4361ee'
-    ))
-
-    fig.add_trace(go.Bar(
-        x = misdemeanor['datetime'], 
-        y = misdemeanor['size'], 
-        name = 'Misdemeanor',
-        marker_color = '#480ca8'
-    ))
-
-    fig.add_trace(go.Bar(
-        x = violation['datetime'], 
-        y = violation['size'], 
-        name = 'Violation',
-        marker_color = '#f72585'
-    ))
-
-    fig.update_layout(
-        title = nta,
-        xaxis_title = 'Hour',
-        yaxis_title = 'Number of Crimes',
-        height = 305,
-        margin = dict(l = 20, r = 20, t = 50, b = 20),
-        legend_x = 0,
-        legend_y = 1
-        )
+def run_recommendation(report, price_range, zipcodes, rental_types, laundry, parking, pets, first, second, third, session):
+    '''
+    Runs a recommendation (as a background job, see start_recommendation) and
+    returns the values of RECOMMENDATION_OUTPUTS. The result (top zipcode, top NTA,
+    ranked zipcodes, ...) is saved in the 'recommendation' store, and the map and
+    the graphs are updated from it by their own callbacks (see below). They are
+    generated here, so those callbacks find them in the caches.
+    '''
+    # the results of a query are reused while the session lasts (see cache.SessionStore)
+    query = json.dumps([price_range, zipcodes, rental_types, laundry, parking, pets, first, second, third])
+    frames = query_frames(session, query, report = report)
+    filtered_df = frames['filtered_df']
+    distances_df = frames['distances_df']
+    rentals_rank = frames['ranking']['zipcode'].to_list()
 
-    # crime rates by day
-    nta_crimes_count = (
-        nta_crimes
-        .groupby(
-            [nta_crimes['datetime'].dt.day, 'law_cat_cd'], 
-            as_index = False)
-        .size()
-        )
+    n_rentals, _ = filtered_df.shape
+    if n_rentals == 0:
+        return [
+            True, 'Oops! There are no rentals with the selected features. Please select other options and try again',
+            '{:,.0f}'.format(df.shape[0]), '0', 
+            '', '', '',
+            {'zipcode': None}
+            ]
 
-    felony = nta_crimes_count[nta_crimes_count['law_cat_cd'] == 'FELONY']
-    misdemeanor = nta_crimes_count[nta_crimes_count['law_cat_cd'] == 'MISDEMEANOR']
-    violation = nta_crimes_count[nta_crimes_count['law_cat_cd'] == 'VIOLATION']
-
-    fig2 = go.Figure()
-    fig2.add_trace(go.Scatter(
-        x = felony['datetime'], 
-        y = felony['size'], 
-        name = 'Felony',
-        line = dict(color = '#4361ee', width = 3)
-    ))
-
-    fig2.add_trace(go.Scatter(
-        x = misdemeanor['datetime'], 
-        y = misdemeanor['size'], 
-        name = 'Misdemeanor',
-        line = dict(color = '#480ca8', width = 3, dash = 'dash')
-    ))
-
-    fig2.add_trace(go.Scatter(
-        x = violation['datetime'], 
-        y = violation['size'], 
-        name = 'Violation',
-        line = dict(color = '#f72585', width = 3, dash = 'dashdot')
-    ))
-
-    fig2.update_layout(
-        title = nta,
-        xaxis_title = 'Day',
-        yaxis_title = 'Number of Crimes',
-        height = 305,
-        margin = dict(l = 20, r = 20, t = 50, b = 20),
-        showlegend = False
-        # legend = dict(
-        #     orientation = 'h',
-        #     yanchor = "bottom",
-        #     y = 1.02,
-        #     xanchor = "right",
-        #     x = 1)
-        )
+    # the zipcode of the top recommendation
+    best_zipcode = filtered_df.loc[0, 'zipcode']
+    
+    # the NTA of the top recommendation
+    nta = str(filtered_df['ntaname'][0])
 
     # distances cards data
     template = '{}: {:.2f} mi ({} in total)'
 
-    distances_df_ = distances_df[distances_df['zipcode_x'] == rentals_rank[0]]
+    distances_df_ = distances_df[distances_df['zipcode_x'] == best_zipcode]
     first_n, _ = distances_df_[distances_df_['facgroup'] == first].shape
     first_d = distances_df_[distances_df_['facgroup'] == first].distance.mean()
     if not np.isnan(first_d): 
@@ -1008,23 +906,349 @@ def update_results(n_clicks, price_range, zipcodes, rental_types, laundry, parki
     else: 
         third_text = third + ': There are not near facilities'
 
-    yelp_data_ = yelp_data_.drop_duplicates(subset = ['restaurant name']).drop_duplicates()
+    result = {
+        'zipcode': str(best_zipcode),
+        'nta': nta,
+        'location': filtered_df.loc[0, ['latitude', 'longitude']].to_list(),
+        'zipcodes': rentals_rank,
+        'facilities': [first, second, third],
+        'miles': miles,
+        'version': version,
+        'query': query
+    }
+
+    if session is not None:
+        rentals_view(result, session)
+    map_url(result, session)
+    report('render map')
+    yelp_figures(result['zipcode'])
+    price_figures(nta)
+    crime_figures(nta)
+    report('figures')
 
     return [
         False, '',
         '{:,.0f}'.format(df.shape[0]), 
         '{:,.0f}'.format(filtered_df.shape[0]),
         first_text, second_text, third_text,
-        filtered_df.to_dict('records'), 
-        open(path, 'r').read(),
-        fig5, # yelp data scatter plot
-        fig6, # yelp data bar plot
-        yelp_data_.to_dict('records'),
-        fig3, 
-        fig4,
-        fig, 
-        fig2
+        result
+    ]
+
+# start a recommendation with the user's choices
+@app.callback(
+    Output('job', 'data'),
+    [Input('generate_button', 'n_clicks')],
+    state = [
+        State('price_range', 'value'),
+        State('zipcodes', 'value'),
+        State('rental_types', 'value'),
+        State('laundry', 'value'),
+        State('parking', 'value'),
+        State('pets', 'value'),
+        State('facilities', 'value'),
+        State('facilities2', 'value'),
+        State('facilities3', 'value'),
+        State('session-id', 'data'),
+        State('job', 'data')
+        ]
+)
+def start_recommendation(n_clicks, price_range, zipcodes, rental_types, laundry, parking, pets, first, second, third, session, job):
+
+    if n_clicks is None:
+        raise PreventUpdate
+
+    args = (price_range, zipcodes, rental_types, laundry, parking, pets, first, second, third, session)
+    try:
+        job_id = jobs.submit(session, lambda report: run_recommendation(report, *args), RECOMMENDATION_STAGES)
+    except JobLimitError as e:
+        # the recommendation in progress is still followed
+        return dict(job or {}, error = str(e))
+
+    return {'id': job_id}
+
+# progress of the recommendation in progress, and its results when it finishes.
+# This is the only callback that enables or disables the polling interval
+@app.callback(
+    [
+    Output('job-poll', 'disabled'),
+    Output('job-progress', 'value'),
+    Output('job-progress', 'children'),
+    Output('job-progress', 'style')
+    ] + RECOMMENDATION_OUTPUTS,
+    [Input('job', 'data'), Input('job-poll', 'n_intervals')]
+)
+def poll_recommendation(job, n_intervals):
+
+    if job is None:
+        raise PreventUpdate
+
+    hidden = {'display': 'none'}
+    unchanged = [dash.no_update] * len(RECOMMENDATION_OUTPUTS)
+    # the alert is shown only once, when the job couldn't be started
+    started = any(t['prop_id'] == 'job.data' for t in dash.callback_context.triggered)
+    alert = [True, job['error']] if started and 'error' in job else unchanged[:2]
+
+    # the status and the result are read at once, so overlapping polls
+    # never see a finished job without its result
+    status = jobs.collect(job['id']) if 'id' in job else None
+    if status is None:
+        # there is no job (or it expired)
+        return [True, 0, '', hidden] + alert + unchanged[2:]
+    if status['state'] == 'collected':
+        # another poll already showed the results
+        return [dash.no_update] * 4 + unchanged
+    if status['state'] in ('queued', 'running'):
+        label = 'Waiting...' if status['state'] == 'queued' else (status['stage'] or 'finishing').capitalize() + '...'
+        return [False, status['progress'], label, {}] + alert + unchanged[2:]
+    if status['state'] == 'error':
+        message = 'Something went wrong generating the recommendations. Please try again'
+        return [True, 0, '', hidden, True, message] + unchanged[2:]
+
+    return [True, 100, '', hidden] + status['result']
+
+# the rentals table goes back to its first page when its rows change
+@app.callback(
+    Output('table', 'page_current'),
+    [
+    Input('table', 'sort_by'),
+    Input('table', 'filter_query'),
+    Input('recommendation', 'data')
+    ]
+)
+def reset_table_page(sort_by, filter_query, result):
+    return 0
+
+# page of the rentals table
+@app.callback(
+    [
+    Output('table', 'data'),
+    Output('table', 'page_count')
+    ],
+    [
+    Input('table', 'page_current'),
+    Input('table', 'page_size'),
+    Input('table', 'sort_by'),
+    Input('table', 'filter_query'),
+    Input('recommendation', 'data')
+    ],
+    State('session-id', 'data')
+)
+def update_table(page_current, page_size, sort_by, filter_query, result, session):
+
+    if result is not None and result['zipcode'] is None:
+        return [], 1
+
+    return rentals_view(result, session).page(page_current, page_size, sort_by, filter_query)
+
+# location of the top recommendation
+@app.callback(
+    Output('map', 'src'),
+    Input('recommendation', 'data'),
+    State('session-id', 'data')
+)
+def update_map(result, session):
+
+    if result is None:
+        raise PreventUpdate
+    if result['zipcode'] is None:
+        return '/maps/NYC-map.html'
+
+    return map_url(result, session)
+
+# restaurants near the top recommendation
+@app.callback(
+    [
+    Output('type-price-rating', 'figure'),
+    Output('food-types-bar', 'figure')
+    ],
+    Input('recommendation', 'data')
+)
+def update_yelp(result):
+
+    if result is None or result['zipcode'] is None:
+        raise PreventUpdate
+
+    return yelp_figures(result['zipcode'])
+
+# the table of restaurants goes back to its first page when its rows change
+@app.callback(
+    Output('yelp-table', 'page_current'),
+    [
+    Input('yelp-table', 'sort_by'),
+    Input('yelp-table', 'filter_query'),
+    Input('recommendation', 'data')
     ]
+)
+def reset_yelp_table_page(sort_by, filter_query, result):
+    return 0
+
+# page of the table of restaurants: those in the zipcode of the top
+# recommendation, or all of them if there are no recommendations
+@app.callback(
+    [
+    Output('yelp-table', 'data'),
+    Output('yelp-table', 'page_count')
+    ],
+    [
+    Input('yelp-table', 'page_current'),
+    Input('yelp-table', 'page_size'),
+    Input('yelp-table', 'sort_by'),
+    Input('yelp-table', 'filter_query'),
+    Input('recommendation', 'data')
+    ]
+)
+def update_yelp_table(page_current, page_size, sort_by, filter_query, result):
+
+    if result is None or result['zipcode'] is None:
+        restaurants = yelp_store.restaurants
+    else:
+        restaurants = yelp_store.get(result['zipcode'])['table']
+
+    return restaurants.page(page_current, page_size, sort_by, filter_query)
+
+# rental prices in the NTA of the top recommendation
+@app.callback(
+    [
+    Output('price-histogram', 'figure'),
+    Output('price-type', 'figure')
+    ],
+    Input('recommendation', 'data')
+)
+def update_prices(result):
+
+    if result is None or result['zipcode'] is None:
+        raise PreventUpdate
+
+    return price_figures(result['nta'])
+
+# crime rates by hour and by day in the NTA of the top recommendation
+@app.callback(
+    [
+    Output('crimes-by-hour', 'figure'),
+    Output('crimes-by-day', 'figure')
+    ],
+    Input('recommendation', 'data')
+)
+def update_crimes(result):
+
+    if result is None or result['zipcode'] is None:
+        raise PreventUpdate
+
+    return crime_figures(result['nta'])
+
+def query_frames(session, query, names = None, report = None):
+    '''
+    Returns the dataframes of a query (the filtered rentals, their distances to
+    the facilities and the ranking of the zipcodes). They are read from the
+    results stored for the session or, if they are not there (e.g. they expired),
+    computed again from the query, i.e. the json list of the user's choices
+    made by run_recommendation. If 'names' is given, only those dataframes are
+    read from the store
+    '''
+    frames = session_store.get(session, query, names) if session is not None else None
+    if frames is not None:
+        return frames
+
+    # the query comes from the browser, so it's checked before it's used
+    try:
+        choices = json.loads(query)
+    except (TypeError, ValueError):
+        raise PreventUpdate
+    if not isinstance(choices, list) or len(choices) != 9:
+        raise PreventUpdate
+
+    filtered_df, distances_df, rentals_rank = recommend_rentals(*choices, report = report)
+    frames = {
+        'filtered_df': filtered_df,
+        'distances_df': distances_df,
+        'ranking': pd.DataFrame({'zipcode': rentals_rank or []})
+        }
+    if session is not None and filtered_df.shape[0] > 0:
+        session_store.put(session, query, frames)
+
+    return frames
+
+def rentals_view(result, session):
+    '''
+    Returns the rows of the rentals table (see myfuncs.TableView): all rentals
+    if there is no recommendation, or the recommended rentals otherwise
+    '''
+    if result is None:
+        return table_views.get_or_compute(None, lambda: TableView(df, rental_columns))
+
+    query = result.get('query')
+    if not isinstance(query, str):
+        raise PreventUpdate
+
+    def build():
+        return TableView(query_frames(session, query, ['filtered_df'])['filtered_df'], rental_columns)
+
+    # the results only depend on the query, so they are shared by all sessions
+    return table_views.get_or_compute(query, build)
+
+def map_url(result, session):
+    '''
+    Returns the url of the map of a recommendation, generating the map if needed
+    '''
+    best_zipcode = result['zipcode']
+    ranks = {f: i + 1 for i, f in enumerate(result['facilities'])}
+
+    # the map only depends on the top zipcode, the facilities, the radius, the data
+    # and the location of the top listing (where the map is centred).
+    # It's generated (if needed) and then served by its url (see cached_map)
+    map_key = map_cache.key(best_zipcode, ranks.keys(), result['miles'], result['version'], result['location'])
+    def render():
+        # the distances computed by update_results, if they are still in the session store
+        frames = session_store.get(session, result['query'], names = ['distances_df']) if session is not None else None
+        if frames is not None:
+            distances_df = frames['distances_df']
+        else:
+            distances_df = query_proximity(
+                table = proximity_df,
+                facilities = facilities_db,
+                zipcodes = [best_zipcode],
+                ranks = ranks,
+                miles = result['miles']
+                )
+        top = pd.DataFrame([result['location']], columns = ['latitude', 'longitude'])
+        m = render_map(top, distances_df, best_zipcode = best_zipcode, facilities = result['facilities'])
+        return m.get_root().render()
+    map_cache.get_or_render(key = map_key, render = render)
+
+    return '/maps/cache/' + map_key
+
+# the graphs only depend on the top zipcode (restaurants) or on its NTA
+# (rental prices and crimes), so they are cached by it (see figures.py)
+def yelp_figures(best_zipcode):
+    '''
+    Returns the graphs of the restaurants of a zipcode
+    '''
+    yelp_aggregates = yelp_store.get(best_zipcode)
+    fig5 = figure_cache.get('yelp-scatter', best_zipcode, lambda: yelp_scatter(yelp_aggregates))
+    fig6 = figure_cache.get('yelp-bars', best_zipcode, lambda: yelp_bars(yelp_aggregates, best_zipcode))
+
+    return fig5, fig6
+
+def price_figures(nta):
+    '''
+    Returns the graphs of rental prices of a NTA
+    '''
+    prices_data = lambda: rental_df[rental_df['ntaname'] == nta]
+    fig3 = figure_cache.get('price-histogram', nta, lambda: price_histogram(prices_data()))
+    fig4 = figure_cache.get('price-box', nta, lambda: price_box(prices_data(), nta))
+
+    return fig3, fig4
+
+def crime_figures(nta):
+    '''
+    Returns the graphs of crime rates by hour and by day of a NTA
+    '''
+    fig = figure_cache.get('crimes-by-hour', nta, lambda: crimes_by_hour(crime_cube, nta))
+    fig2 = figure_cache.get('crimes-by-day', nta, lambda: crimes_by_day(crime_cube, nta))
+
+    return fig, fig2
+
+profiler.report()
 
 if __name__ == "__main__":
     app.run_server(debug = False)
\ No newline at end of file
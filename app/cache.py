@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+"""
+@authors: Maria Lara C (mlaracue), Mengyao Xu (mengyaox) and Lu Zhang (luzhang3)
+
+This module contains the caches used by app.py to avoid recomputing
+results for queries that were already answered
+
+Imported by: app.py
+"""
+from collections import OrderedDict
+from storage     import frame_to_bytes, frame_from_bytes
+import threading
+import hashlib
+import pickle
+import time
+import uuid
+import os
+
+def data_version(paths):
+    '''
+    Returns a short identifier of the current version of the data,
+    based on the size and the last modification time of each file.
+    Missing files are ignored.
+
+    Parameters:
+    ----------
+        paths: list of file paths
+
+    Returns:
+    --------
+    string with an hexadecimal hash
+    '''
+    h = hashlib.sha1()
+    for p in paths:
+        if os.path.isfile(p):
+            stat = os.stat(p)
+            h.update('{}:{}:{}'.format(p, stat.st_size, stat.st_mtime).encode())
+
+    return h.hexdigest()[:12]
+
+class LRUCache:
+    '''
+    Bounded, thread-safe, least recently used cache. When the cache is full,
+    the entry that was used the longest time ago is removed. The cache keeps
+    track of the number of hits and misses, and it's emptied every time
+    the version of the data changes.
+
+    Parameters:
+    ----------
+        maxsize: maximum number of entries. Default is 128
+    '''
+    def __init__(self, maxsize = 128):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default = None):
+        '''
+        Returns the value stored for 'key' (or 'default' if there is none)
+        '''
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        '''
+        Stores 'value' under 'key', removing the oldest entries if needed
+        '''
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last = False)
+
+    def get_or_compute(self, key, func):
+        '''
+        Returns the value stored for 'key'. If there is none, it's computed
+        by calling 'func' (without arguments) and then stored.
+        The lock is not held while 'func' runs, so two threads asking for the
+        same missing key may both compute it.
+        '''
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = func()
+            self.put(key, value)
+
+        return value
+
+    def clear(self):
+        '''
+        Removes all entries and resets the counters
+        '''
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def set_version(self, version):
+        '''
+        Sets the version of the data used to compute the cached values.
+        If it changed, all entries are removed.
+        '''
+        with self._lock:
+            changed = version != self.version
+            self.version = version
+        if changed:
+            self.clear()
+
+    def stats(self):
+        '''
+        Returns a dictionary with the size of the cache, the number
+        of hits and misses, and the hit rate
+        '''
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0
+                }
+
+class MapCache:
+    '''
+    Size-bounded cache of the html maps generated by render_map. Every map
+    is stored under a hash of its inputs (see MapCache.key) in the folder
+    'path', and the most recently served maps are also kept in memory
+    (along with the time when they were stored).
+    Maps that are older than 'max_age' seconds, or that exceed 'max_files'
+    (least recently served first), are removed.
+
+    Parameters:
+    ----------
+        path: folder where the maps are stored. Default is './maps/cache/'
+        max_files: maximum number of maps stored in 'path'. Default is 500
+        max_age: maximum age (in seconds) of a stored map. Default is a week
+        memory_size: number of maps kept in memory. Default is 32
+    '''
+    def __init__(self, path = './maps/cache/', max_files = 500, max_age = 7 * 24 * 3600, memory_size = 32):
+        self.path = path
+        self.max_files = max_files
+        self.max_age = max_age
+        self.memory = LRUCache(maxsize = memory_size)
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok = True)
+
+    @staticmethod
+    def key(zipcode, facilities, miles, version, location = None):
+        '''
+        Returns the identifier of a map, i.e. a hash of the zipcode of the top
+        recommendation, the facility groups (in any order), the radius, the
+        version of the data and the location (latitude, longitude) of the top
+        listing, rounded to 5 decimals (about a meter)
+        '''
+        location = ','.join('{:.5f}'.format(float(c)) for c in location) if location is not None else ''
+        parts = '|'.join([str(zipcode), ','.join(sorted(facilities)), str(miles), str(version), location])
+
+        return hashlib.sha1(parts.encode()).hexdigest()[:20]
+
+    def filename(self, key):
+        '''
+        Returns the path of the file where the map 'key' is stored
+        '''
+        return os.path.join(self.path, key + '.html')
+
+    def get(self, key):
+        '''
+        Returns the html of the map 'key' (or None if it's not cached)
+        '''
+        entry = self.get_entry(key)
+
+        return entry[0] if entry is not None else None
+
+    def get_entry(self, key):
+        '''
+        Returns the html of the map 'key' and the time (as a timestamp) when
+        it was stored or last read from disk, or None if it's not cached
+        '''
+        entry = self.memory.get(key)
+        if entry is not None:
+            return entry
+
+        filename = self.filename(key)
+        try:
+            stat = os.stat(filename)
+            if time.time() - stat.st_mtime > self.max_age:
+                return None
+            with open(filename, 'r', encoding = 'utf-8') as f:
+                html = f.read()
+            # the modification time is used to find the least recently served maps
+            os.utime(filename)
+        except OSError:
+            return None
+
+        entry = (html, stat.st_mtime)
+        self.memory.put(key, entry)
+
+        return entry
+
+    def put(self, key, html):
+        '''
+        Stores the html of the map 'key' and removes old maps if needed
+        '''
+        filename = self.filename(key)
+        tmp = filename + '.tmp'
+        with open(tmp, 'w', encoding = 'utf-8') as f:
+            f.write(html)
+        os.replace(tmp, filename)
+
+        self.memory.put(key, (html, os.stat(filename).st_mtime))
+        self.evict()
+
+    def get_or_render(self, key, render):
+        '''
+        Returns the html of the map 'key'. If it's not cached, the map is
+        generated by calling 'render' (without arguments) and then stored.
+        '''
+        html = self.get(key)
+        if html is None:
+            html = render()
+            self.put(key, html)
+
+        return html
+
+    def evict(self):
+        '''
+        Removes the maps that are too old and, if there are still more
+        than 'max_files', the least recently served ones
+        '''
+        with self._lock:
+            now = time.time()
+            files = []
+            for name in os.listdir(self.path):
+                if not name.endswith('.html'):
+                    continue
+                filename = os.path.join(self.path, name)
+                try:
+                    mtime = os.stat(filename).st_mtime
+                    if now - mtime > self.max_age:
+                        os.remove(filename)
+                    else:
+                        files.append((mtime, filename))
+                except OSError:
+                    pass
+
+            files.sort()
+            for _, filename in files[:max(0, len(files) - self.max_files)]:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+class SessionStore:
+    '''
+    Server-side store of the intermediate results of each session (e.g. the
+    filtered rentals and their distances to the facilities), so follow-up
+    interactions don't have to compute them again. The results are stored by
+    session and query in the folder 'path', one file by entry, with the
+    dataframes in a compact binary form (see storage.frame_to_bytes), so they
+    are shared by all the workers of the server. Entries expire 'ttl' seconds
+    after they were last used, and when there are more than 'max_entries' the
+    least recently used ones are removed.
+
+    Parameters:
+    ----------
+        path: folder where the entries are stored. Default is './state/sessions/'
+        ttl: time to live (in seconds) of an entry. Default is 30 minutes
+        max_entries: maximum number of entries. Default is 256
+    '''
+    def __init__(self, path = './state/sessions/', ttl = 30 * 60, max_entries = 256):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok = True)
+
+    def __len__(self):
+        return len(self._files())
+
+    @staticmethod
+    def _hash(value, size):
+        return hashlib.sha1(str(value).encode()).hexdigest()[:size]
+
+    def filename(self, session, query):
+        '''
+        Returns the path of the file where the entry of a query is stored
+        '''
+        return os.path.join(self.path, '{}-{}.bin'.format(self._hash(session, 16), self._hash(query, 24)))
+
+    def _files(self):
+        return [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith('.bin')]
+
+    def put(self, session, query, frames):
+        '''
+        Stores the dataframes of a query
+
+        Parameters:
+        ----------
+            session: id of the session
+            query: identifier of the query (e.g. a json string with the user's choices)
+            frames: dictionary of pandas dataframes, e.g. {'filtered_df': ..., 'distances_df': ...}
+        '''
+        entry = {name: frame_to_bytes(df) for name, df in frames.items()}
+        filename = self.filename(session, query)
+        tmp = filename + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(entry, f, protocol = pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, filename)
+        self._evict()
+
+    def get(self, session, query, names = None):
+        '''
+        Returns the dataframes stored for a query (or None if there are none
+        or they expired). If 'names' is given, only those dataframes are returned
+        '''
+        filename = self.filename(session, query)
+        try:
+            if time.time() - os.stat(filename).st_mtime > self.ttl:
+                os.remove(filename)
+                return None
+            # using an entry extends its life
+            os.utime(filename)
+            if names is not None and len(names) == 0:
+                return {}
+            with open(filename, 'rb') as f:
+                entry = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+
+        return {name: frame_from_bytes(data) for name, data in entry.items() if names is None or name in names}
+
+    def drop_session(self, session):
+        '''
+        Removes all the entries of a session
+        '''
+        prefix = os.path.join(self.path, self._hash(session, 16) + '-')
+        for filename in self._files():
+            if filename.startswith(prefix):
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
+
+    def nbytes(self):
+        '''
+        Returns the size (in bytes) of the stored entries
+        '''
+        total = 0
+        for filename in self._files():
+            try:
+                total += os.stat(filename).st_size
+            except OSError:
+                pass
+
+        return total
+
+    def _evict(self):
+        # the modification time of an entry is the last time it was used
+        with self._lock:
+            now = time.time()
+            files = []
+            for filename in self._files():
+                try:
+                    mtime = os.stat(filename).st_mtime
+                    if now - mtime > self.ttl:
+                        os.remove(filename)
+                    else:
+                        files.append((mtime, filename))
+                except OSError:
+                    pass
+
+            files.sort()
+            for _, filename in files[:max(0, len(files) - self.max_entries)]:
+                try:
+                    os.remove(filename)
+                except OSError:
+                    pass
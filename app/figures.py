@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+@authors: Maria Lara C (mlaracue), Mengyao Xu (mengyaox) and Lu Zhang (luzhang3)
+
+This module contains the graphs shown in the results page and the cache where
+they are stored. Every graph depends only on the zipcode of the top
+recommendation (restaurants) or on its NTA (rental prices and crimes), so
+it's built once per zipcode (or NTA) and version of the data and then served
+from the cache, already serialized. plotly is imported the first time a graph
+is built.
+
+Imported by: app.py
+"""
+from cache import LRUCache
+import threading
+import json
+
+class FigureCache:
+    '''
+    Cache of the graphs, stored by (kind of graph, zipcode or NTA, version
+    of the data) as JSON-ready dictionaries, so a cached graph is returned
+    without using plotly at all. It keeps the number of hits and misses
+    by kind of graph.
+
+    Parameters:
+    ----------
+        maxsize: maximum number of graphs. Default is 512
+    '''
+    def __init__(self, maxsize = 512):
+        self.cache = LRUCache(maxsize = maxsize)
+        self.kinds = {}
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        '''
+        Sets the version of the data. If it changed, all graphs are removed
+        '''
+        self.cache.set_version(version)
+        with self._lock:
+            self.kinds = {}
+
+    def get(self, kind, key, build):
+        '''
+        Returns the graph 'kind' for 'key' (a zipcode or a NTA). If it's not
+        cached, it's built by calling 'build' (without arguments, it must
+        return a plotly figure), serialized and then stored.
+        '''
+        missing = object()
+        full_key = (kind, key, self.cache.version)
+        figure = self.cache.get(full_key, missing)
+        hit = figure is not missing
+        if not hit:
+            figure = json.loads(build().to_json())
+            self.cache.put(full_key, figure)
+
+        with self._lock:
+            counts = self.kinds.setdefault(kind, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+        return figure
+
+    def stats(self):
+        '''
+        Returns a dictionary with the stats of the cache (see LRUCache.stats)
+        and the number of hits and misses, and the hit rate, by kind of graph
+        '''
+        stats = self.cache.stats()
+        with self._lock:
+            stats['kinds'] = {
+                kind: dict(counts, hit_rate = counts['hits'] / (counts['hits'] + counts['misses']))
+                for kind, counts in self.kinds.items()
+                }
+
+        return stats
+
+def yelp_scatter(aggregates):
+    '''
+    Average rating by food type and price level (the size of each
+    point is the average number of ratings)
+
+    Parameters:
+    ----------
+        aggregates: aggregates of a zipcode (see YelpStore.get)
+    '''
+    import plotly.express as px
+
+    colors_d = {'$':'#ade8f4', '$$':'#48cae4', '$$$':'#0096c7', '$$$$':'#03045e'}
+
+    fig5 = px.scatter(
+        aggregates['scatter'],
+        x = "food type",
+        y = "rating",
+        size = "num_rating",
+        color = "price level",
+        size_max = 40,
+        hover_data = {'rating': ':.2f', 'num_rating': ':,.0f'},
+        color_discrete_map = colors_d
+    )
+
+    fig5.update_xaxes(tickangle = 45)
+
+    fig5.update_layout(
+        showlegend = False,
+        xaxis_title = 'Food Type (top 15)',
+        yaxis_title = 'Average Rating',
+        height = 380,
+        margin = dict(l = 10, r = 10, t = 50, b = 10)
+    )
+
+    return fig5
+
+def yelp_bars(aggregates, zipcode):
+    '''
+    Relative frequency of the most popular food types in a zipcode
+
+    Parameters:
+    ----------
+        aggregates: aggregates of the zipcode (see YelpStore.get)
+        zipcode: zipcode shown in the title
+    '''
+    import plotly.express as px
+
+    food_types_count = aggregates['food_types']
+    n_max = food_types_count.pct.max()
+
+    fig6 = px.bar(
+        food_types_count,
+        y = 'pct',
+        x = 'food type',
+        text = 'pct',
+        hover_data = {'pct': ':.2f'}
+    )
+    fig6.update_traces(texttemplate = '%{text:%.2f}', textposition = 'outside')
+    fig6.update_yaxes(visible = True, showticklabels = False)
+    fig6.update_layout(
+        title = 'Most popular food types in zipcode ' + zipcode,
+        yaxis_title = 'Relative frequency (%)',
+        yaxis = {'range':[0, n_max + .01]},
+        uniformtext_minsize = 6,
+        uniformtext_mode = 'hide',
+        height = 400,
+        margin = dict(l = 10, r = 10, t = 50, b = 10)
+    )
+
+    return fig6
+
+def price_histogram(prices_data):
+    '''
+    Distribution of the rental prices
+
+    Parameters:
+    ----------
+        prices_data: rentals of a NTA (with the column price)
+    '''
+    import plotly.express as px
+
+    colors = ['#4cc9f0', '#4361ee', '#3a0ca3', '#560bad', '#7209b7', '#f72585']
+
+    fig3 = px.histogram(
+        prices_data,
+        x = 'price',
+        nbins = 15,
+        title = 'Distribution of Prices',
+        color_discrete_sequence = [colors[-1]],
+        labels = {'price':'$','count':'no. of rentals'},
+        height = 300
+        )
+
+    fig3.update_layout(
+        yaxis_title = "No. of Rentals",
+        xaxis_title = 'Price (USD Dollars)',
+        margin = dict(l = 20, r = 20, t = 50, b = 20),
+        showlegend = False,
+        title_x = 0.5,
+        height = 300
+        )
+
+    return fig3
+
+def price_box(prices_data, nta):
+    '''
+    Distribution of the rental prices by type of rental
+
+    Parameters:
+    ----------
+        prices_data: rentals of the NTA (with the columns type and price)
+        nta: name of the NTA shown in the title
+    '''
+    import plotly.express as px
+
+    fig4 = px.box(
+        prices_data,
+        x = 'type',
+        y = 'price')
+
+    fig4.update_layout(
+        title_text = 'Distribution of Prices by Rental Type in ' + nta,
+        yaxis_title = 'Price (USD Dollars)',
+        xaxis_title = 'Type of Rental',
+        height = 300
+        )
+
+    return fig4
+
+def crimes_by_hour(crime_cube, nta):
+    '''
+    Number of crimes by hour of the day and category in a NTA
+
+    Parameters:
+    ----------
+        crime_cube: CrimeCube with the number of crimes
+        nta: name of the NTA
+    '''
+    import plotly.graph_objects as go
+
+    felony = crime_cube.counts(nta, 'FELONY', by = 'hour')
+    misdemeanor = crime_cube.counts(nta, 'MISDEMEANOR', by = 'hour')
+    violation = crime_cube.counts(nta, 'VIOLATION', by = 'hour')
+
+    fig = go.Figure()
+    fig.add_trace(go.Bar(
+        x = felony[0],
+        y = felony[1],
+        name = 'Felony',
+        marker_color = '#4361ee'
+    ))
+
+    fig.add_trace(go.Bar(
+        x = misdemeanor[0],
+        y = misdemeanor[1],
+        name = 'Misdemeanor',
+        marker_color = '#480ca8'
+    ))
+
+    fig.add_trace(go.Bar(
+        x = violation[0],
+        y = violation[1],
+        name = 'Violation',
+        marker_color = '#f72585'
+    ))
+
+    fig.update_layout(
+        title = nta,
+        xaxis_title = 'Hour',
+        yaxis_title = 'Number of Crimes',
+        height = 305,
+        margin = dict(l = 20, r = 20, t = 50, b = 20),
+        legend_x = 0,
+        legend_y = 1
+        )
+
+    return fig
+
+def crimes_by_day(crime_cube, nta):
+    '''
+    Number of crimes by day of the month and category in a NTA
+
+    Parameters:
+    ----------
+        crime_cube: CrimeCube with the number of crimes
+        nta: name of the NTA
+    '''
+    import plotly.graph_objects as go
+
+    felony = crime_cube.counts(nta, 'FELONY', by = 'day')
+    misdemeanor = crime_cube.counts(nta, 'MISDEMEANOR', by = 'day')
+    violation = crime_cube.counts(nta, 'VIOLATION', by = 'day')
+
+    fig2 = go.Figure()
+    fig2.add_trace(go.Scatter(
+        x = felony[0],
+        y = felony[1],
+        name = 'Felony',
+        line = dict(color = '#4361ee', width = 3)
+    ))
+
+    fig2.add_trace(go.Scatter(
+        x = misdemeanor[0],
+        y = misdemeanor[1],
+        name = 'Misdemeanor',
+        line = dict(color = '#480ca8', width = 3, dash = 'dash')
+    ))
+
+    fig2.add_trace(go.Scatter(
+        x = violation[0],
+        y = violation[1],
+        name = 'Violation',
+        line = dict(color = '#f72585', width = 3, dash = 'dashdot')
+    ))
+
+    fig2.update_layout(
+        title = nta,
+        xaxis_title = 'Day',
+        yaxis_title = 'Number of Crimes',
+        height = 305,
+        margin = dict(l = 20, r = 20, t = 50, b = 20),
+        showlegend = False
+        # legend = dict(
+        #     orientation = 'h',
+        #     yanchor = "bottom",
+        #     y = 1.02,
+        #     xanchor = "right",
+        #     x = 1)
+        )
+
+    return fig2
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+"""
+@authors: Maria Lara C (mlaracue), Mengyao Xu (mengyaox) and Lu Zhang (luzhang3)
+
+This module runs the heavy requests of app.py (e.g. the recommendations for
+all zipcodes and rental types) as background jobs on a local pool of threads,
+so the web workers are not blocked while they run. Every job is split in
+stages that report when they finish, which the app shows as a progress bar
+while it polls for the result. The state and the result of every job are
+stored in a local folder, so the polls can be answered by any worker of
+the server, not only by the one that runs the job.
+
+Imported by: app.py
+"""
+from concurrent.futures import ThreadPoolExecutor
+import traceback
+import threading
+import pickle
+import json
+import time
+import uuid
+import os
+
+class JobLimitError(Exception):
+    '''
+    Raised when a session already has the maximum number of running jobs
+    '''
+    pass
+
+class JobManager:
+    '''
+    Pool of threads where the background jobs run. Each session can have
+    at most 'max_per_session' jobs waiting or running at the same time.
+    Every job is stored in the folder 'path' as a json file with its state
+    (<id>.json) and, once it finishes, a pickle with its result (<id>.pkl).
+    Finished jobs whose result is never collected, and jobs whose state
+    didn't change in 'ttl' seconds (e.g. their worker was stopped), are removed.
+
+    Parameters:
+    ----------
+        path: folder where the jobs are stored. Default is './state/jobs/'
+        max_workers: number of jobs that run at the same time. Default is 4
+        max_per_session: maximum number of pending jobs by session. Default is 1
+        ttl: time (in seconds) a job is kept. Default is 10 minutes
+    '''
+    def __init__(self, path = './state/jobs/', max_workers = 4, max_per_session = 1, ttl = 10 * 60):
+        self.path = path
+        self.max_per_session = max_per_session
+        self.ttl = ttl
+        self.executor = ThreadPoolExecutor(max_workers = max_workers, thread_name_prefix = 'job')
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok = True)
+
+    def _file(self, job_id, ext):
+        return os.path.join(self.path, job_id + ext)
+
+    def _read(self, filename):
+        try:
+            with open(filename, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, job_id, job):
+        # the file is replaced at once, so readers never see half of it
+        filename = self._file(job_id, '.json')
+        tmp = filename + '.' + uuid.uuid4().hex + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp, filename)
+
+    def submit(self, session, func, stages):
+        '''
+        Starts a job in the background
+
+        Parameters:
+        ----------
+            session: id of the session that starts the job
+            func: function that runs the job. It's called with a single argument,
+                  a function that must be called with the name of each stage
+                  when it finishes (e.g. report('filter')), and its return value
+                  (which must be picklable) is the result of the job
+            stages: list with the names of the stages, in the order they run
+
+        Returns:
+        --------
+        the id of the job
+
+        Raises:
+        -------
+        JobLimitError if the session already has too many pending jobs
+        '''
+        with self._lock:
+            self._cleanup()
+            pending = 0
+            for name in os.listdir(self.path):
+                if name.endswith('.json'):
+                    job = self._read(os.path.join(self.path, name))
+                    if job is not None and job['session'] == session and job['state'] in ('queued', 'running'):
+                        pending += 1
+            if pending >= self.max_per_session:
+                raise JobLimitError('There is already a recommendation in progress. Please wait until it finishes')
+
+            job_id = uuid.uuid4().hex
+            job = {
+                'session': session,
+                'stages': list(stages),
+                'done': 0,
+                'state': 'queued',
+                'error': None
+                }
+            # the job is stored before its id is returned, so it can be polled right away
+            self._write(job_id, job)
+
+        self.executor.submit(self._run, job_id, job, func)
+
+        return job_id
+
+    def _run(self, job_id, job, func):
+        # only this thread writes the state of the job
+        lock = threading.Lock()
+
+        def report(stage):
+            # stages that were skipped (e.g. cached results) count as finished
+            with lock:
+                done = max(job['done'], job['stages'].index(stage) + 1)
+                if done != job['done']:
+                    job['done'] = done
+                    self._write(job_id, job)
+
+        with lock:
+            job['state'] = 'running'
+            self._write(job_id, job)
+        try:
+            result = func(report)
+            filename = self._file(job_id, '.pkl')
+            with open(filename + '.tmp', 'wb') as f:
+                pickle.dump(result, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(filename + '.tmp', filename)
+            with lock:
+                job['done'] = len(job['stages'])
+                job['state'] = 'done'
+                self._write(job_id, job)
+        except Exception as e:
+            traceback.print_exc()
+            with lock:
+                job['error'] = str(e)
+                job['state'] = 'error'
+                self._write(job_id, job)
+
+    @staticmethod
+    def _status(job):
+        n_stages = len(job['stages'])
+        return {
+            'state': job['state'],
+            'stage': job['stages'][job['done']] if job['done'] < n_stages else None,
+            'progress': int(100 * job['done'] / n_stages) if n_stages else 100,
+            'error': job['error']
+            }
+
+    def status(self, job_id):
+        '''
+        Returns the state of a job ('queued', 'running', 'done', 'error' or
+        'collected'), the stage that is running, the percentage of stages
+        finished and the error message (if any).
+        Returns None if the job doesn't exist (or it expired).
+        '''
+        job = self._read(self._file(job_id, '.json'))
+        if job is None:
+            job = self._read(self._file(job_id, '.collected'))
+            return dict(self._status(job), state = 'collected') if job is not None else None
+
+        return self._status(job)
+
+    def collect(self, job_id):
+        '''
+        Returns the status of a job (see JobManager.status) and, if it finished,
+        its result under the key 'result'. A finished job is collected only once:
+        the job is claimed by renaming its state file, so when several polls
+        (of any worker) ask for it at the same time, only one of them gets the
+        result and the others get the state 'collected'
+        '''
+        status = self.status(job_id)
+        if status is None or status['state'] not in ('done', 'error'):
+            return status
+
+        claimed = self._file(job_id, '.collected')
+        try:
+            os.rename(self._file(job_id, '.json'), claimed)
+        except FileNotFoundError:
+            return self.status(job_id)
+        # the claim is kept for a while, so late polls know the job was collected
+        os.utime(claimed)
+
+        result = None
+        if status['state'] == 'done':
+            try:
+                with open(self._file(job_id, '.pkl'), 'rb') as f:
+                    result = pickle.load(f)
+                os.remove(self._file(job_id, '.pkl'))
+            except (OSError, pickle.UnpicklingError, EOFError):
+                status = dict(status, state = 'error', error = 'The result of the job was lost')
+
+        return dict(status, result = result)
+
+    def _cleanup(self):
+        now = time.time()
+        for name in os.listdir(self.path):
+            filename = os.path.join(self.path, name)
+            try:
+                if now - os.stat(filename).st_mtime > self.ttl:
+                    os.remove(filename)
+            except OSError:
+                pass
@@ -4,13 +4,24 @@
 This module contains the main functions used by app.py
 """
 import pandas       as pd
-from folium.plugins import MarkerCluster
-import folium
+import numpy        as np
+import threading
 
-def filter_rentals(price_range, zipcodes, rental_types, laundry, parking, pets, df):
+# approximate radius of earth in miles (6373 km)
+EARTH_RADIUS_MILES = 6373.0 * 0.621371
+# approximate length (in miles) of a degree of latitude
+MILES_PER_DEGREE = EARTH_RADIUS_MILES * np.pi / 180
+# largest radius (in miles) stored in the precomputed proximity table
+PROXIMITY_MAX_MILES = 1.0
+
+def filter_rentals(price_range, zipcodes, rental_types, laundry, parking, pets, df, index = None):
     '''
-    Filters the rentals dataframe based on the user's choices
+    Filters the rentals dataframe based on the user's choices.
+    If a RentalIndex built over 'df' is given, it's used instead of
+    scanning the whole dataframe
     '''
+    if index is not None:
+        return index.filter(price_range, zipcodes, rental_types, laundry, parking, pets)
     
     min_price, max_price = price_range
 
@@ -34,48 +45,295 @@ def filter_rentals(price_range, zipcodes, rental_types, laundry, parking, pets,
         df = df[df['type'].isin(rental_types)]
     
     return df.reset_index(drop = True)
-    
+
+class RentalIndex:
+    '''
+    Index over the rentals dataframe (in long format) used by filter_rentals.
+    Rentals are partitioned by their amenity codes (laundry, parking and pets)
+    and sorted by price within each partition. Each zipcode and each rental
+    type has a bitmap (boolean array) marking the rows where it appears, so a
+    filter becomes a binary search on prices plus an intersection of bitmaps.
+    The index is meant to be built once, when the data is loaded.
+
+    Parameters:
+    ----------
+        df: pandas dataframe with the columns price, zipcode, type,
+        laundry_code, parking_code and pet_code
+    '''
+    def __init__(self, df):
+        self.df = df
+        price = df['price'].to_numpy(dtype = np.float64)
+
+        self.zipcodes = {z: (df['zipcode'] == z).to_numpy() for z in df['zipcode'].dropna().unique()}
+        self.types = {t: (df['type'] == t).to_numpy() for t in df['type'].dropna().unique()}
+
+        # rows of each partition, sorted by price (missing prices go last)
+        self.partitions = {}
+        groups = pd.Series(np.arange(len(df))).groupby(
+            [df['laundry_code'].to_numpy(), df['parking_code'].to_numpy(), df['pet_code'].to_numpy()]
+            )
+        for key, rows in groups.indices.items():
+            rows = rows[np.argsort(price[rows], kind = 'mergesort')]
+            self.partitions[key] = (rows, price[rows])
+
+    def _bitmap(self, bitmaps, values):
+        '''
+        Returns the union of the bitmaps of the selected values
+        '''
+        if isinstance(values, str):
+            values = [values]
+        mask = np.zeros(len(self.df), dtype = bool)
+        for v in values:
+            if v in bitmaps:
+                mask |= bitmaps[v]
+
+        return mask
+
+    def filter(self, price_range, zipcodes, rental_types, laundry, parking, pets):
+        '''
+        Returns the same dataframe as filter_rentals(..., df = self.df)
+        '''
+        if (laundry, parking, pets) not in self.partitions:
+            return self.df.iloc[:0].reset_index(drop = True)
+
+        min_price, max_price = price_range
+        rows, prices = self.partitions[(laundry, parking, pets)]
+        start = np.searchsorted(prices, min_price, side = 'left')
+        stop = np.searchsorted(prices, max_price, side = 'right')
+        rows = rows[start:stop]
+
+        mask = self._bitmap(self.zipcodes, zipcodes)[rows] & self._bitmap(self.types, rental_types)[rows]
+
+        return self.df.iloc[np.sort(rows[mask])].reset_index(drop = True)
+
+def haversine(lat1, lon1, lat2, lon2):
+    '''
+    Vectorized version of the distance function. It takes arrays
+    (or scalars) of coordinates and returns the distance (in miles)
+    between each pair of locations. The inputs follow numpy's
+    broadcasting rules, so passing a column of rentals and a row
+    of facilities returns the full matrix of distances.
+
+    Parameters:
+    ----------
+        lat1: float or array. Latitude of location(s) 1
+        lon1: float or array. Longitude of location(s) 1
+        lat2: float or array. Latitude of location(s) 2
+        lon2: float or array. Longitude of location(s) 2
+
+    Returns:
+    --------
+    numpy array with the distances in miles
+    '''
+    lat1 = np.radians(np.asarray(lat1, dtype = np.float64))
+    lon1 = np.radians(np.asarray(lon1, dtype = np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype = np.float64))
+    lon2 = np.radians(np.asarray(lon2, dtype = np.float64))
+
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+
+    a = np.sin(dlat / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+    return EARTH_RADIUS_MILES * c
+
 def distance(lat1, lon1, lat2, lon2):
-    from math import sin, cos, sqrt, atan2, radians
     '''
     This function takes two coordinates and returns 
-    the distance (in miles) between the two locations
+    the distance (in miles) between the two locations.
+    It's a thin wrapper around the haversine function
 
     Parameters:
     ----------
         lat1: float. Latitude of location 1
-        lon2: float. Longitude of location 1
+        lon1: float. Longitude of location 1
         lat2: float. Latitude of location 2
-        lon1: float. Longitude of location 2
+        lon2: float. Longitude of location 2
     
     Returns: 
     --------
     distance between two coordinates in miles (float)
     '''
-    # approximate radius of earth in km
-    R = 6373.0
-    
-    lat1 = radians(lat1)
-    lon1 = radians(lon1)
-    lat2 = radians(lat2)
-    lon2 = radians(lon2)
+    return float(haversine(lat1, lon1, lat2, lon2))
 
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
+class FacilityIndex:
+    '''
+    Spatial index over the surroundings (or facilities) dataframe.
+    Facilities are hashed into a latitude/longitude grid with cells of
+    (at least) 'cell_miles' miles per side, so a radius query only has to
+    measure the facilities that fall in the cells around each point.
+    The index is meant to be built once, when the data is loaded.
 
-    a = sin(dlat / 2)**2 + cos(lat1) * cos(lat2) * sin(dlon / 2)**2
-    c = 2 * atan2(sqrt(a), sqrt(1 - a))
+    Parameters:
+    ----------
+        facilities: pandas dataframe with the columns latitude and longitude
+        cell_miles: size of the side of each cell. Default is 0.25
+    '''
+    def __init__(self, facilities, cell_miles = 0.25):
+        lat = facilities['latitude'].to_numpy(dtype = np.float64)
+        lon = facilities['longitude'].to_numpy(dtype = np.float64)
 
-    d = R * c * 0.621371
-    
-    return d
+        # facilities without coordinates can't be close to anything
+        valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+
+        self.cell_miles = cell_miles
+        self.place_index = facilities.index.to_numpy()
+        self.latitude = lat
+        self.longitude = lon
+
+        # the width of a degree of longitude shrinks with the latitude, so we
+        # use the northernmost facility to keep every cell at least 'cell_miles' wide
+        max_lat = np.abs(lat[valid]).max() if len(valid) else 0
+        self.lat_step = cell_miles / MILES_PER_DEGREE
+        self.lon_step = self.lat_step / np.cos(np.radians(max_lat))
+
+        # sort the facilities by cell, so every cell is a slice of 'order'
+        cells = self._cells(lat[valid], lon[valid])
+        order = np.lexsort((valid, cells[:, 1], cells[:, 0]))
+        self.order = valid[order]
+        keys, starts, counts = np.unique(cells[order], axis = 0, return_index = True, return_counts = True)
+        self.cells = {
+            (y, x): (start, start + n) for (y, x), start, n in zip(keys.tolist(), starts.tolist(), counts.tolist())
+            }
+
+    def _cells(self, lat, lon):
+        '''
+        Returns the (row, column) cell of each coordinate
+        '''
+        return np.column_stack([
+            np.floor(lat / self.lat_step), 
+            np.floor(lon / self.lon_step)
+            ]).astype(np.int64)
+
+    def query_radius(self, lat, lon, miles):
+        '''
+        Finds all facilities within 'miles' miles of each point
+
+        Parameters:
+        ----------
+            lat: array with the latitudes of the points
+            lon: array with the longitudes of the points
+            miles: the radius of the query
 
-def compute_distances(rentals, facilities, ranks, miles = 0.25):
+        Returns:
+        -------
+        three numpy arrays: the position of the point, the index of the
+        facility (as in the original dataframe) and the distance between them.
+        Pairs are ordered by point and then by facility (as in the original dataframe)
+        '''
+        lat = np.asarray(lat, dtype = np.float64)
+        lon = np.asarray(lon, dtype = np.float64)
+        # number of neighbor cells that have to be visited in each direction
+        k = int(np.ceil(miles / self.cell_miles))
+        offsets = range(-k, k + 1)
+
+        empty = np.array([], dtype = np.int64), self.place_index[:0], np.array([])
+        valid = np.flatnonzero(~(np.isnan(lat) | np.isnan(lon)))
+        if len(valid) == 0:
+            return empty
+
+        # points in the same cell share the same candidates
+        cells, codes = np.unique(self._cells(lat[valid], lon[valid]), axis = 0, return_inverse = True)
+        codes = codes.ravel()
+        points = valid[np.argsort(codes, kind = 'mergesort')]
+        ends = np.cumsum(np.bincount(codes, minlength = len(cells)))
+
+        origins = []
+        places = []
+        for c, (y, x) in enumerate(cells.tolist()):
+            slices = [self.cells.get((y + dy, x + dx)) for dy in offsets for dx in offsets]
+            candidates = [self.order[start:stop] for start, stop in filter(None, slices)]
+            if candidates:
+                candidates = np.concatenate(candidates)
+                cell_points = points[(ends[c - 1] if c else 0):ends[c]]
+                origins.append(np.repeat(cell_points, len(candidates)))
+                places.append(np.tile(candidates, len(cell_points)))
+
+        if not origins:
+            return empty
+
+        # order the pairs by point and then by facility
+        origins = np.concatenate(origins)
+        places = np.concatenate(places)
+        order = np.lexsort((places, origins))
+        origins = origins[order]
+        places = places[order]
+
+        d = haversine(lat[origins], lon[origins], self.latitude[places], self.longitude[places])
+        # keep only the pairs that are close enough
+        close = d <= miles
+
+        return origins[close], self.place_index[places[close]], d[close]
+
+def find_nearby(lat, lon, facilities, miles, index = None, chunk_size = 1000000):
+    '''
+    This function finds all facilities within 'miles' miles of each point.
+    If a FacilityIndex is given, only the facilities that are near each
+    point are measured. Otherwise, the distances are computed in chunks of
+    points (at most 'chunk_size' point-facility pairs at a time) to cap the
+    memory used.
+
+    Parameters:
+    ----------
+        lat: array with the latitudes of the points
+        lon: array with the longitudes of the points
+        facilities: pandas dataframe with surroundings (or facilities)
+        with the columns latitude and longitude
+        miles: the cutoff to define when a facility is close enough
+        index: a FacilityIndex built over all facilities (optional).
+        'facilities' must be a subset of the indexed dataframe
+        chunk_size: maximum number of pairs computed at once
+
+    Returns:
+    -------
+    three numpy arrays: the position of the point, the index of the
+    facility and the distance between them, ordered by point and then
+    by facility (as in the facilities dataframe)
+    '''
+    lat = np.asarray(lat, dtype = np.float64)
+    lon = np.asarray(lon, dtype = np.float64)
+
+    if index is not None:
+        rows, places, d = index.query_radius(lat, lon, miles)
+        # keep only the facilities the user is interested in
+        keep = np.isin(places, facilities.index.to_numpy())
+
+        return rows[keep], places[keep], d[keep]
+
+    place_index = facilities.index.to_numpy()
+    fac_lat = facilities['latitude'].to_numpy()
+    fac_lon = facilities['longitude'].to_numpy()
+
+    # number of points that fit in one chunk
+    step = max(1, chunk_size // max(1, len(facilities)))
+
+    rows = [np.array([], dtype = np.int64)]
+    places = [place_index[:0]]
+    distances = [np.array([])]
+
+    for start in range(0, len(lat), step):
+        stop = start + step
+        d = haversine(
+            lat[start:stop, None], 
+            lon[start:stop, None], 
+            fac_lat[None, :], 
+            fac_lon[None, :]
+            )
+        # keep only the pairs that are close enough
+        chunk_rows, cols = np.nonzero(d <= miles)
+        rows.append(chunk_rows + start)
+        places.append(place_index[cols])
+        distances.append(d[chunk_rows, cols])
+
+    return np.concatenate(rows), np.concatenate(places), np.concatenate(distances)
+
+def compute_distances(rentals, facilities, ranks, miles = 0.25, chunk_size = 1000000, index = None):
     '''
     This functions computes the distance between all rentals
     and surroundings (or facilities) and keeps only facilities from
     which the distance to the rental (by zipcode) is less than 'miles'
-    This function depends on the 'distance' function.
+    This function depends on the 'find_nearby' function.
 
     Parameters:
     ----------
@@ -87,6 +345,9 @@ def compute_distances(rentals, facilities, ranks, miles = 0.25):
         For example {'Health care': 1, 'Transportation': 2, 'Restaurants': 3}
         miles: the cutoff to define when a facility is close enough to a rental.
         Default is 0.25 (walking distance)
+        chunk_size: maximum number of pairs computed at once
+        index: a FacilityIndex built over all facilities (optional).
+        'facilities' must be a subset of the indexed dataframe
     
     Returns:
     -------
@@ -94,30 +355,182 @@ def compute_distances(rentals, facilities, ranks, miles = 0.25):
     (defined by the 'miles' param)
     '''
     rentals = rentals.drop_duplicates(subset = ['zipcode'])
-    distances_df = pd.DataFrame({})
-    zip_codes = []
-    left_index = []
-    distances = []
-    
-    for i, row in rentals.iterrows():
-        lat1, lon1 = row['latitude'], row['longitude']
-        for j, row2 in facilities.iterrows():
-            lat2, lon2 = row2['latitude'], row2['longitude']
-            d = distance(lat1, lon1, lat2, lon2)
-            zip_codes.append(row['zipcode'])
-            left_index.append(j)
-            distances.append(d)
-
-    distances_df = pd.DataFrame({'zipcode': zip_codes, 'place_index': left_index, 'distance': distances})
+
+    rows, places, d = find_nearby(
+        rentals['latitude'].to_numpy(), 
+        rentals['longitude'].to_numpy(), 
+        facilities, 
+        miles, 
+        index = index, 
+        chunk_size = chunk_size
+        )
+
+    distances_df = pd.DataFrame({
+        'zipcode': rentals['zipcode'].to_numpy()[rows], 
+        'place_index': places, 
+        'distance': d
+        })
     facilities = facilities.rename_axis('place_index').reset_index()
     distances_df = distances_df.merge(right = facilities, on = 'place_index')
     distances_df['rank'] = distances_df['facgroup'].map(ranks)
-    
-    distances_df = distances_df[distances_df['distance'] <= miles]
 
     return distances_df
 
-def get_ordering(distances_df):
+def build_proximity_table(zipcodes_lat_lon, facilities, max_miles = PROXIMITY_MAX_MILES, index = None):
+    '''
+    This function computes, once per data refresh, the distance between each
+    rental zipcode and every facility within 'max_miles' miles. Since both the
+    zipcodes and the facilities are fixed between refreshes, the result can be
+    stored and filtered by the query_proximity function on every request.
+
+    Parameters:
+    ----------
+        zipcodes_lat_lon: pandas dataframe with the columns zipcode,
+        latitude and longitude (the centroid of each rental zipcode)
+        facilities: pandas dataframe with surroundings (or facilities)
+        with the columns latitude, longitude and facgroup
+        max_miles: the largest radius that can be queried afterwards
+        index: a FacilityIndex built over 'facilities' (optional)
+
+    Returns:
+    -------
+    a dataframe with the columns zipcode, facgroup, place_index and distance
+    '''
+    zipcodes_lat_lon = zipcodes_lat_lon.drop_duplicates(subset = ['zipcode'])
+
+    if index is None:
+        index = FacilityIndex(facilities)
+
+    rows, places, d = index.query_radius(
+        zipcodes_lat_lon['latitude'].to_numpy(), 
+        zipcodes_lat_lon['longitude'].to_numpy(), 
+        max_miles
+        )
+
+    return pd.DataFrame({
+        'zipcode': zipcodes_lat_lon['zipcode'].to_numpy()[rows],
+        'facgroup': facilities.loc[places, 'facgroup'].to_numpy(),
+        'place_index': places,
+        'distance': d
+        })
+
+def query_proximity(table, facilities, zipcodes, ranks, miles = 0.25, max_miles = PROXIMITY_MAX_MILES):
+    '''
+    This function filters the table returned by build_proximity_table
+    and returns the same dataframe as the compute_distances function,
+    without computing any distance.
+
+    Parameters:
+    ----------
+        table: pandas dataframe returned by build_proximity_table
+        facilities: pandas dataframe with surroundings (or facilities)
+        used to build the table
+        zipcodes: list of zipcodes of the filtered rentals
+        rank : a dictionary with the ordering of user's preference.
+        For example {'Health care': 1, 'Transportation': 2, 'Restaurants': 3}
+        miles: the cutoff to define when a facility is close enough to a rental.
+        It can't be larger than 'max_miles'
+        max_miles: the 'max_miles' used to build the table. Default is PROXIMITY_MAX_MILES
+
+    Returns:
+    -------
+    a dataframe with facilities that are within x miles from each rental
+    (defined by the 'miles' param)
+
+    Raises:
+    -------
+    ValueError if 'miles' is larger than 'max_miles' (the table doesn't
+    have the facilities that are farther away, so the results would be incomplete)
+    '''
+    if miles > max_miles:
+        raise ValueError(
+            'The proximity table only has the facilities within {} miles ({} requested). '
+            'Use compute_distances or rebuild the table with a larger max_miles'.format(max_miles, miles))
+
+    mask = (
+        (table['zipcode'].isin(zipcodes)) &
+        (table['facgroup'].isin(ranks.keys())) &
+        (table['distance'] <= miles)
+        )
+
+    distances_df = table.loc[mask, ['zipcode', 'place_index', 'distance']]
+    facilities = facilities.rename_axis('place_index').reset_index()
+    distances_df = distances_df.merge(right = facilities, on = 'place_index')
+    distances_df['rank'] = distances_df['facgroup'].map(ranks)
+
+    return distances_df
+
+def score_proximity(distances_df, by = 'zipcode_x', n_ranks = None):
+    '''
+    This function computes the index used by get_ordering for each
+    value of the column 'by' in a single pass. For each group of facilities,
+    the number of facilities divided by their mean distance is re-scaled from
+    0 to 100, weighted by the user's ranking and then added up.
+
+    Parameters:
+    -----------
+        distances_df = pandas dataframe returned by the 
+        compute_distances() function
+        by: the column that identifies the rentals. Default is 'zipcode_x'
+        n_ranks: the number of ranked facility groups. The group ranked
+        as r gets a weight of (n_ranks + 1 - r) / n_ranks. By default,
+        it's the largest rank in distances_df
+    
+    Returns:
+    --------
+    pandas series with the index of each rental sorted from best to worst
+    '''
+    # facilities that were not ranked by the user are not taken into account
+    ranks = distances_df['rank'].to_numpy(dtype = np.float64)
+    ranked = ~np.isnan(ranks)
+    if n_ranks is None:
+        n_ranks = np.nanmax(ranks) if ranked.any() else 0
+
+    rentals, rental_keys = pd.factorize(distances_df[by], sort = True)
+    groups, group_keys = pd.factorize(distances_df['facgroup'])
+    n_groups = len(group_keys)
+    rentals, groups, ranks = rentals[ranked], groups[ranked], ranks[ranked]
+    distance = distances_df['distance'].to_numpy(dtype = np.float64)[ranked]
+    # rentals that only have unranked facilities nearby are left out
+    present = np.bincount(rentals, minlength = len(rental_keys)) > 0
+    rentals = (np.cumsum(present) - 1)[rentals]
+    rental_keys = np.asarray(rental_keys)[present]
+
+    # number of facilities and mean distance by rental and group of facilities.
+    # The (rental, group) pairs are dense and small, so they are counted with
+    # bincount instead of being sorted
+    pair_ids = rentals * n_groups + groups
+    n_pairs = len(rental_keys) * n_groups
+    count = np.bincount(pair_ids, minlength = n_pairs)
+    pairs = np.flatnonzero(count)
+    count = count[pairs]
+    mean_distance = np.bincount(pair_ids, weights = distance, minlength = n_pairs)[pairs] / count
+    pair_rentals, pair_groups = pairs // n_groups, pairs % n_groups
+    # the rank of each pair (all the facilities of a group have the same rank)
+    pair_ranks = np.zeros(n_pairs)
+    pair_ranks[pair_ids] = ranks
+
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        index = count / mean_distance
+
+        # re-scale the index from 0 to 100 within each group of facilities
+        lo = np.full(n_groups, np.inf)
+        hi = np.full(n_groups, -np.inf)
+        np.minimum.at(lo, pair_groups, index)
+        np.maximum.at(hi, pair_groups, index)
+        scaled = (index - lo[pair_groups]) / (hi[pair_groups] - lo[pair_groups]) * 100
+    scaled[np.bincount(pair_groups, minlength = n_groups)[pair_groups] == 1] = 100
+
+    weights = (n_ranks + 1 - pair_ranks[pairs]) / n_ranks
+    # groups where the index can't be re-scaled don't add to the total
+    contribution = np.nan_to_num(scaled * weights, nan = 0.0, posinf = 0.0, neginf = 0.0)
+    scores = np.bincount(pair_rentals, weights = contribution, minlength = len(rental_keys))
+
+    order = np.argsort(-scores, kind = 'mergesort')
+
+    return pd.Series(scores[order], index = rental_keys[order])
+
+def get_ordering(distances_df, n_ranks = None):
     '''
     This function computes and index based on user's ranking of
     surroundings (or facilites) and returns an ordering for 
@@ -130,6 +543,7 @@ def get_ordering(distances_df):
     -----------
         distances_df = pandas dataframe returned by the 
         compute_distances() function
+        n_ranks: the number of ranked facility groups (see score_proximity)
     
     Returns:
     --------
@@ -146,59 +560,507 @@ def get_ordering(distances_df):
     elif n_zipcodes == 1:
         return list(distances_df.zipcode_x.unique())
     else:
-        pd.options.mode.chained_assignment = None
+        order = score_proximity(distances_df, by = 'zipcode_x', n_ranks = n_ranks)
         
-        order = (distances_df
-                .groupby(['zipcode_x', 'facgroup', 'rank'], as_index = False)
-                .agg({'place_index':'count', 'distance':'mean'})
+        return list(order.index)
+
+def batch_recommendations(profiles, rental_df, facilities, table = None, miles = 0.25, rental_index = None, facilities_index = None):
+    '''
+    This function returns the ordering of zipcodes (as get_ordering does) for
+    many preference profiles at once. The distances are computed only once,
+    for all the zipcodes and facilities involved, and all profiles are scored
+    together as a matrix operation.
+
+    Parameters:
+    -----------
+        profiles: list of dictionaries with the keys price_range, zipcodes,
+        rental_types, laundry, parking, pets (as in filter_rentals) and 
+        facilities (list of facility groups ranked from most to least important)
+        rental_df: pandas dataframe with all rentals
+        facilities: pandas dataframe with surroundings (or facilities)
+        table: the table returned by build_proximity_table (optional). If it's
+        not given, or 'miles' is larger than PROXIMITY_MAX_MILES, the distances
+        are computed with compute_distances
+        miles: the cutoff to define when a facility is close enough to a rental.
+        rental_index: a RentalIndex built over rental_df (optional)
+        facilities_index: a FacilityIndex built over facilities (optional)
+
+    Returns:
+    --------
+    list with the ordering of zipcodes (from best to worst) of each profile.
+    As in get_ordering, the ordering is None if there are no results
+    '''
+    if len(profiles) == 0:
+        return []
+
+    # zipcodes of the rentals that match each profile
+    profile_zipcodes = []
+    profile_ranks = []
+    for profile in profiles:
+        filtered_df = filter_rentals(
+            profile['price_range'], 
+            profile['zipcodes'], 
+            profile['rental_types'], 
+            profile['laundry'], 
+            profile['parking'], 
+            profile['pets'],
+            df = rental_df,
+            index = rental_index
+            )
+        profile_zipcodes.append(set(filtered_df['zipcode']))
+        profile_ranks.append({f: i + 1 for i, f in enumerate(profile['facilities'])})
+
+    # the distances are computed once for all profiles
+    all_zipcodes = sorted(set().union(*profile_zipcodes))
+    all_groups = {f: 1 for ranks in profile_ranks for f in ranks}
+    if table is not None and miles <= PROXIMITY_MAX_MILES:
+        distances_df = query_proximity(table, facilities, all_zipcodes, all_groups, miles = miles)
+    else:
+        rentals = rental_df[rental_df['zipcode'].isin(all_zipcodes)]
+        distances_df = compute_distances(
+            rentals, 
+            facilities[facilities['facgroup'].isin(all_groups.keys())], 
+            all_groups, 
+            miles = miles,
+            index = facilities_index
+            )
+
+    # number of facilities divided by their mean distance, by zipcode and group
+    order = (distances_df
+            .groupby(['zipcode_x', 'facgroup'], observed = True)
+            .agg(count = ('place_index', 'count'), distance = ('distance', 'mean'))
+            )
+    index = (order['count'] / order['distance']).unstack()
+    zipcodes = np.asarray(index.index)
+    groups = list(index.columns)
+    index = index.to_numpy(dtype = np.float64)
+    # no profile matches any rental, or there are no facilities nearby
+    if index.size == 0:
+        return [None] * len(profiles)
+
+    # profiles x zipcodes: whether the zipcode has rentals matching the profile
+    eligible = np.array([[z in zips for z in zipcodes] for zips in profile_zipcodes], dtype = bool).reshape(len(profiles), len(zipcodes))
+    # profiles x groups: the weight of each group of facilities
+    weights = np.zeros((len(profiles), len(groups)))
+    for p, ranks in enumerate(profile_ranks):
+        n_ranks = max(ranks.values())
+        for g, group in enumerate(groups):
+            if group in ranks:
+                weights[p, g] = (n_ranks + 1 - ranks[group]) / n_ranks
+
+    # profiles x zipcodes x groups: the index used by each profile
+    valid = eligible[:, :, None] & ~np.isnan(index)[None, :, :] & (weights > 0)[:, None, :]
+    values = np.where(valid, index[None, :, :], np.nan)
+
+    # re-scale the index from 0 to 100 within each profile and group
+    lo = np.where(valid, values, np.inf).min(axis = 1, keepdims = True)
+    hi = np.where(valid, values, -np.inf).max(axis = 1, keepdims = True)
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        scaled = (values - lo) / (hi - lo) * 100
+    scaled = np.where(valid & (valid.sum(axis = 1, keepdims = True) == 1), 100, scaled)
+
+    contribution = np.nan_to_num(scaled * weights[:, None, :], nan = 0.0, posinf = 0.0, neginf = 0.0)
+    scores = contribution.sum(axis = 2)
+    has_results = valid.any(axis = 2)
+
+    orderings = []
+    for p in range(len(profiles)):
+        candidates = np.flatnonzero(has_results[p])
+        if len(candidates) == 0:
+            orderings.append(None)
+        else:
+            best = candidates[np.argsort(-scores[p, candidates], kind = 'mergesort')]
+            orderings.append(list(zipcodes[best]))
+
+    return orderings
+
+class CrimeIndex:
+    '''
+    Nearest neighbour lookup over the locations where crimes were reported,
+    built once per Neighborhood Tabulation Area (NTA). Within each NTA, the
+    locations are sorted by the number of crimes, so when two locations are
+    equally close the one with fewer crimes is returned.
+
+    Parameters:
+    ----------
+        crime_count: pandas dataframe with the columns ntaname, lat, lon
+        and count (number of crimes at each location)
+    '''
+    def __init__(self, crime_count):
+        self.ntas = {}
+        for nta, group in crime_count.groupby('ntaname', observed = True, sort = False):
+            group = group.sort_values(by = 'count', kind = 'mergesort')
+            self.ntas[nta] = (
+                group['lat'].to_numpy(dtype = np.float64),
+                group['lon'].to_numpy(dtype = np.float64),
+                group['count'].to_numpy()
                 )
-    
-        order['index'] = order['place_index'] / order['distance']
-        order = order.sort_values(by = 'facgroup')
-
-        # this function is defined within the get_ordering function because
-        # it's the only function that uses it.
-        def min_max_t(x):
-            '''
-            This function takes a pandas series or list
-            and returns a re-scaled series from 0 to 100
-            '''
-            if len(x) == 1:
-                return 100
+
+    def nearest(self, df):
+        '''
+        Finds the nearest crime location (within the same NTA) for every row
+
+        Parameters:
+        ----------
+            df: pandas dataframe with the columns ntaname, latitude and longitude
+
+        Returns:
+        -------
+        a dataframe (aligned with the index of 'df') with the columns lat, lon,
+        count and distance of the nearest crime location. Rows in NTAs without
+        crimes have missing values
+        '''
+        n = len(df)
+        lat = df['latitude'].to_numpy(dtype = np.float64)
+        lon = df['longitude'].to_numpy(dtype = np.float64)
+        nearest_lat = np.full(n, np.nan)
+        nearest_lon = np.full(n, np.nan)
+        count = np.full(n, np.nan)
+        distances = np.full(n, np.nan)
+
+        groups = pd.Series(np.arange(n)).groupby(df['ntaname'].to_numpy())
+        for nta, rows in groups.indices.items():
+            if nta not in self.ntas:
+                continue
+            crime_lat, crime_lon, crime_count = self.ntas[nta]
+            d = haversine(lat[rows, None], lon[rows, None], crime_lat[None, :], crime_lon[None, :])
+            closest = np.argmin(np.where(np.isnan(d), np.inf, d), axis = 1)
+            nearest_lat[rows] = crime_lat[closest]
+            nearest_lon[rows] = crime_lon[closest]
+            count[rows] = crime_count[closest]
+            distances[rows] = d[np.arange(len(rows)), closest]
+
+        return pd.DataFrame(
+            {'lat': nearest_lat, 'lon': nearest_lon, 'count': count, 'distance': distances}, 
+            index = df.index
+            )
+
+class CrimeCube:
+    '''
+    Number of crimes by Neighborhood Tabulation Area (NTA), by hour of the day
+    (or by day of the month) and by category (law_cat_cd), stored in two dense
+    arrays that are built once:
+        by_hour: NTA x hour (0 to 23) x category
+        by_day: NTA x day (1 to 31) x category
+
+    Parameters:
+    ----------
+        crime_geom: pandas dataframe with the columns ntaname, datetime and law_cat_cd
+    '''
+    def __init__(self, crime_geom):
+        crimes = crime_geom.dropna(subset = ['ntaname', 'datetime', 'law_cat_cd'])
+        ntas, ntanames = pd.factorize(np.asarray(crimes['ntaname'], dtype = object))
+        self.categories = sorted(set(crimes['law_cat_cd']))
+        categories = pd.Categorical(crimes['law_cat_cd'], categories = self.categories).codes
+
+        self.ntas = {nta: i for i, nta in enumerate(ntanames)}
+        self.hours = np.arange(24)
+        self.days = np.arange(1, 32)
+        shape = (len(ntanames), len(self.categories))
+        self.by_hour = self._cube(ntas, crimes['datetime'].dt.hour.to_numpy(), categories, shape, len(self.hours))
+        self.by_day = self._cube(ntas, crimes['datetime'].dt.day.to_numpy() - 1, categories, shape, len(self.days))
+
+    @staticmethod
+    def _cube(ntas, periods, categories, shape, n_periods):
+        n_ntas, n_categories = shape
+        cells = (ntas * n_periods + periods) * n_categories + categories
+
+        return np.bincount(cells, minlength = n_ntas * n_periods * n_categories).reshape(n_ntas, n_periods, n_categories)
+
+    def counts(self, nta, category, by = 'hour'):
+        '''
+        Returns the number of crimes of a category in a NTA, for the hours
+        (or days) when at least one was reported
+
+        Parameters:
+        ----------
+            nta: name of the NTA
+            category: category of the crime (e.g. 'FELONY')
+            by: 'hour' (hour of the day) or 'day' (day of the month). Default is 'hour'
+
+        Returns:
+        --------
+        two numpy arrays: the hours (or days) and the number of crimes
+        '''
+        periods, cube = (self.hours, self.by_hour) if by == 'hour' else (self.days, self.by_day)
+        if nta not in self.ntas or category not in self.categories:
+            return periods[:0], np.zeros(0, dtype = cube.dtype)
+
+        size = cube[self.ntas[nta], :, self.categories.index(category)]
+        observed = size > 0
+
+        return periods[observed], size[observed]
+
+class YelpStore:
+    '''
+    Aggregates of the Yelp data by zipcode, computed once so the restaurant
+    charts and table don't have to filter the data on every request.
+    For each zipcode, it stores:
+        scatter: average number of ratings and rating by food type and price
+                 level, for the most common food types
+        food_types: relative frequency of the most common food types
+        table: the restaurants (one row each) sorted by rating, as a TableView
+               that serves the restaurant table one page at a time
+
+    Parameters:
+    ----------
+        yelp_data: pandas dataframe with a row for each restaurant and food type
+        n_scatter: number of food types in the scatter plot. Default is 15
+        n_bars: number of food types in the bar plot. Default is 25
+        columns: columns of the restaurant table. Default is all columns
+    '''
+    def __init__(self, yelp_data, n_scatter = 15, n_bars = 25, columns = None):
+        self.n_scatter = n_scatter
+        self.n_bars = n_bars
+        self.columns = columns if columns is not None else list(yelp_data.columns)
+        # every restaurant, shown when there are no recommendations
+        self.restaurants = TableView(yelp_data.drop_duplicates(subset = 'restaurant name'), self.columns)
+        self.zipcodes = {
+            zipcode: self._aggregate(group)
+            for zipcode, group in yelp_data.groupby('zipcode', observed = True, sort = False)
+            }
+        self._empty = self._aggregate(yelp_data.iloc[:0])
+
+    def _aggregate(self, yelp_data_):
+        yelp_data_ = yelp_data_.sort_values(by = 'rating', ascending = False)
+        # categorical food types keep the categories that are not in the zipcode
+        if isinstance(yelp_data_['food type'].dtype, pd.CategoricalDtype):
+            yelp_data_ = yelp_data_.assign(**{'food type': yelp_data_['food type'].cat.remove_unused_categories()})
+        # most common food types first; ties are broken by name, so the top
+        # food types don't depend on the dtype of the column
+        counts = yelp_data_['food type'].value_counts()
+        counts.index = counts.index.astype(object)
+        counts = counts.iloc[np.lexsort((counts.index.to_numpy(dtype = str), -counts.to_numpy()))]
+        frequency = counts / counts.sum()
+
+        top_food_types = frequency[:self.n_scatter].index.to_list()
+        scatter = yelp_data_[yelp_data_['food type'].isin(top_food_types)].reset_index(drop = True)
+        scatter = (
+            scatter[['food type', 'price level', 'num_rating', 'rating']]
+            .groupby(['food type', 'price level'], as_index = False, observed = True)[['num_rating', 'rating']]
+            .agg('mean')
+            )
+
+        food_types = frequency[:self.n_bars].to_frame().reset_index()
+        food_types.columns = ['food type', 'pct']
+
+        table = yelp_data_.drop_duplicates(subset = ['restaurant name']).drop_duplicates()
+
+        return {'scatter': scatter, 'food_types': food_types, 'table': TableView(table, self.columns)}
+
+    def get(self, zipcode):
+        '''
+        Returns the aggregates of a zipcode (empty if it has no restaurants)
+        '''
+        return self.zipcodes.get(zipcode, self._empty)
+
+def explode_food_types(yelp_df, id_col = 'restaurant_id', column = 'food types'):
+    '''
+    Normalizes the comma-separated food types of the Yelp data into a long
+    table with a row for each restaurant and food type. Restaurants without
+    food types are dropped, and the food types keep the order in which
+    they are listed for each restaurant.
+
+    Parameters:
+    ----------
+        yelp_df: Yelp dataframe with one row per restaurant
+        id_col: column with the (integer) id of each restaurant. Default is 'restaurant_id'
+        column: column with the comma-separated food types. Default is 'food types'
+
+    Returns:
+    --------
+    pandas dataframe with the columns id_col (int32) and 'food type' (categorical)
+    '''
+    food_types = yelp_df[[id_col, column]].dropna(subset = [column])
+    # one row per food type (split and explode run over the whole column at once)
+    food_types = food_types.assign(**{column: food_types[column].str.split(',')}).explode(column)
+    food_types = pd.DataFrame({
+        id_col: food_types[id_col].to_numpy().astype('int32'),
+        'food type': food_types[column].str.strip().astype('category')
+        })
+
+    return food_types.reset_index(drop = True)
+
+# operators of the filter queries of the DataTables, as written by dash
+# (the order matters: e.g. '>=' has to be checked before '=')
+FILTER_OPERATORS = [
+    ['ge ', '>='],
+    ['le ', '<='],
+    ['lt ', '<'],
+    ['gt ', '>'],
+    ['ne ', '!='],
+    ['eq ', '='],
+    ['contains '],
+    ['datestartswith ']
+]
+
+def parse_filter_query(filter_query):
+    '''
+    Splits the filter query of a DataTable (e.g. '{price} >= 2000 && {type} contains Studio')
+    into a list of (column, operator, value) tuples, where the operator is
+    'ge', 'le', 'lt', 'gt', 'ne', 'eq', 'contains' or 'datestartswith'.
+    Values are kept as strings (without quotes): they are cast according to
+    the operator and the column when the rows are filtered (see TableView).
+    Parts that can't be parsed are ignored
+    '''
+    conditions = []
+    for filter_part in (filter_query or '').split(' && '):
+        for operator_type in FILTER_OPERATORS:
+            operator = next((o for o in operator_type if o in filter_part), None)
+            if operator is None:
+                continue
+
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+            value_part = value_part.strip()
+            if not name or not value_part:
+                break
+
+            quote = value_part[0]
+            if quote == value_part[-1] and quote in ("'", '"', '`') and len(value_part) > 1:
+                value = value_part[1:-1].replace('\\' + quote, quote)
             else:
-                return (x - x.min()) / (x.max() - x.min()) * 100
-
-        # the places selected by the user
-        top_three_places = list(distances_df.facgroup.unique())
-        order_ = pd.DataFrame({})
-        for i in top_three_places:
-            tmp = order[order['facgroup'] == i]
-            tmp['index'] = min_max_t(tmp['index'].values)
-            order_ = pd.concat([order_, tmp], axis = 0)
-
-        order_['lambda'] = (4 - order_['rank']) / 3
-        order_['index_t'] = order_['index'] * order_['lambda']
-        order_ = order_.pivot_table(index = 'zipcode_x', columns = 'facgroup', values = 'index_t').reset_index()
-        order_['order'] = order_.sum(axis = 1)
-        order_ = order_.sort_values(by = 'order', ascending = False).reset_index(drop = True)
-        
-        return list(set(order_['zipcode_x']))
+                value = value_part
+            conditions.append((name, operator_type[0].strip(), value))
+            break
+
+    return conditions
+
+class TableView:
+    '''
+    Rows of a DataTable served one page at a time (the table uses custom paging,
+    sorting and filtering, so only the current page is sent to the browser).
+    The rank of every row in each column is computed once, so sorting by one
+    column is a lookup of a precomputed ordering and sorting by several columns
+    is a lexsort of integer ranks. Sorting is stable, so ties keep the original
+    order (e.g. the ranking of the recommendations).
 
-def save_map(filtered_df, distances_df, best_zipcode, path = './maps/'):
+    Parameters:
+    ----------
+        df: pandas dataframe with the rows in their default order
+        columns: columns shown in the table
+        max_queries: number of (sorting, filter) results kept. Default is 32
+    '''
+    def __init__(self, df, columns, max_queries = 32):
+        self.df = df[[col for col in columns if col in df]].reset_index(drop = True)
+        self.max_queries = max_queries
+
+        # dense rank of each row by column and direction (missing values go last
+        # in both directions) and the order of the rows by each of them
+        self.ranks = {}
+        self.orders = {}
+        for col in self.df:
+            values = self.df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+            codes, uniques = pd.factorize(values, sort = True)
+            missing = codes < 0
+            for direction, ranks in [('asc', codes), ('desc', len(uniques) - 1 - codes)]:
+                ranks = np.where(missing, len(uniques), ranks).astype(np.int32)
+                self.ranks[(col, direction)] = ranks
+                self.orders[(col, direction)] = np.argsort(ranks, kind = 'mergesort')
+
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.df)
+
+    def _mask(self, conditions):
+        '''
+        Returns a boolean array with the rows that meet all the conditions
+        '''
+        mask = np.ones(len(self.df), dtype = bool)
+        for col, operator, value in conditions:
+            if col not in self.df:
+                continue
+            values = self.df[col]
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                values = values.astype(object)
+
+            if operator in ('contains', 'datestartswith'):
+                # text operators always compare the text of the values
+                # (missing values never match)
+                text = values.astype(str).where(values.notna(), '')
+                if operator == 'contains':
+                    matches = text.str.contains(value, case = False, regex = False)
+                else:
+                    matches = text.str.startswith(value)
+            elif pd.api.types.is_numeric_dtype(values):
+                # numeric columns compare numbers; a value that is not a number matches nothing
+                try:
+                    number = float(value)
+                except ValueError:
+                    matches = np.zeros(len(self.df), dtype = bool)
+                else:
+                    matches = getattr(values, '__{}__'.format(operator))(number)
+            else:
+                # text columns (e.g. zipcodes) compare strings
+                matches = getattr(values.astype(str), '__{}__'.format(operator))(value)
+                # missing values are only different from any value
+                matches = matches | values.isna() if operator == 'ne' else matches & values.notna()
+            mask &= np.asarray(matches, dtype = bool)
+
+        return mask
+
+    def rows(self, sort_by = None, filter_query = None):
+        '''
+        Returns the positions of the rows that pass the filter, in the order given
+        by 'sort_by' (a list of {'column_id': ..., 'direction': 'asc' or 'desc'})
+        '''
+        sort_by = [
+            (s['column_id'], s['direction']) for s in (sort_by or []) if (s['column_id'], s['direction']) in self.ranks
+            ]
+        key = (tuple(sort_by), filter_query or '')
+        with self._lock:
+            if key in self._rows:
+                return self._rows[key]
+
+        if not sort_by:
+            rows = np.arange(len(self.df))
+        elif len(sort_by) == 1:
+            rows = self.orders[sort_by[0]]
+        else:
+            # lexsort uses the last key as the primary one
+            rows = np.lexsort([self.ranks[s] for s in reversed(sort_by)])
+
+        conditions = parse_filter_query(filter_query)
+        if conditions:
+            rows = rows[self._mask(conditions)[rows]]
+
+        with self._lock:
+            if len(self._rows) >= self.max_queries:
+                self._rows.pop(next(iter(self._rows)))
+            self._rows[key] = rows
+
+        return rows
+
+    def page(self, page_current, page_size, sort_by = None, filter_query = None):
+        '''
+        Returns the records of a page (starting at 0) and the number of pages.
+        Pages after the last one (e.g. after a filter removed rows) return the last page
+        '''
+        rows = self.rows(sort_by, filter_query)
+        page_count = max(1, -(-len(rows) // page_size))
+        start = min(page_current or 0, page_count - 1) * page_size
+        records = self.df.iloc[rows[start:start + page_size]].to_dict('records')
+
+        return records, page_count
+
+def render_map(filtered_df, distances_df, best_zipcode, facilities = None):
     '''
     This plots the top recommendation along with all the surrounding places
-    that are important for the user and save the map into the app/maps/ folder.
-    Every map has a unique identified, as follows:
-        YYYY-MM-DD_ZC_FirstSecondThird.htlm
-    Where:
-        ZC: Zipcode of top recommendation
-        First: place ranked as most important in user's selections
-        Second: place ranked as second in user's selections
-        Third: place ranked as third in user's selections
-    '''
-    import datetime
-    
-    all_facilities = set(distances_df['facgroup'])
+    that are important for the user and returns the folium map.
+    Colors are assigned to the facility groups in alphabetical order,
+    so the same inputs always produce the same map. The groups are the ones
+    in 'facilities' (the user's selections) or, if it's not given, the ones
+    found in distances_df.
+    '''
+    # folium is only needed to draw maps, so it's imported the first time a map is drawn
+    import folium
+    from folium.plugins import MarkerCluster
+
+    all_facilities = sorted(set(facilities if facilities is not None else distances_df['facgroup']))
     
     colors = ['darkpurple', 'lightgreen', 'pink']
 
@@ -273,18 +1135,5 @@ def save_map(filtered_df, distances_df, best_zipcode, path = './maps/'):
                 icon = icons_dict[facgroup]['icon'],
                 prefix = 'fa')
         ).add_to(marker_cluster)
-    
-    # create a timestamp to now when the map was generated
-    current_time = datetime.datetime.now().date()
-    
-    # specify the facilities that are being used in the file name
-    top_three = ''.join([x[:4] for x in all_facilities])
 
-    # create the path where the map is going to be saved
-    path = path + str(current_time) + '_' + best_zipcode + '-' +  top_three  + '.html'
-    # path = path + str(current_time) + '_' + best_zipcode + '.html'
-    
-    # save the map into an html file
-    m.save(path)
-    
-    return
\ No newline at end of file
+    return m
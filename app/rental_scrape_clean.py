@@ -333,6 +333,20 @@ if os.path.exists(r'..\cleaned-data') == False:
     os.mkdir(r'..\cleaned-data')
 ##save cleaned data to working directory for later algorithms 
 
-cleaned_df.to_csv(r'..\cleaned-data\manhattan-rental_cleaned.csv', index=False)
+from storage import read_cleaned, write_cleaned
+write_cleaned(cleaned_df, 'manhattan-rental_cleaned.csv')
+
+####TODO: precompute distances between rental zipcodes and facilities
+from myfuncs import build_proximity_table
+from storage import build_zipcode_table
+
+facilities_db = read_cleaned('manhattan-surroundings_cleaned.csv')
+facilities_db = facilities_db.drop_duplicates()
+##table with the centroid of every predefined zipcode (and the ones in the data)
+##so the app doesn't need to query pgeocode when it starts
+zips_table = build_zipcode_table([str(x) for x in zips] + list(cleaned_df['zipcode']) + list(facilities_db['zipcode']))
+zips_lat_lon = zips_table[zips_table['zipcode'].isin([str(x) for x in zips])]
+proximity_df = build_proximity_table(zips_lat_lon, facilities_db)
+write_cleaned(proximity_df, 'zipcode-proximity.csv')
 print('----Rental Data Refresh Complete----')
 # cleaned_df.to_excel('.\clean_data\cleaned results.xlsx', index=False)
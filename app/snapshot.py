@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+"""
+@authors: Maria Lara C (mlaracue), Mengyao Xu (mengyaox) and Lu Zhang (luzhang3)
+
+This module builds the serving snapshot: the data that app.py needs, already
+transformed (rentals in long format with their NTA, Yelp data with a row per
+food type, crime counts, etc.). The snapshot is built once per data refresh
+and saved into ./cleaned-data/serving-snapshot.pkl, so the app only has to
+load it. It's rebuilt whenever the cleaned data changes.
+
+It can also be run on its own to build the snapshot:
+    python snapshot.py
+
+Imported by: app.py
+"""
+from myfuncs import FacilityIndex, CrimeCube, build_proximity_table, explode_food_types
+from storage import read_cleaned, read_geo_cleaned, read_zipcode_table, write_cleaned
+from cache   import data_version
+import pandas as pd
+import numpy  as np
+import pickle
+import os
+
+# change it every time the pipeline changes, so old snapshots are rebuilt
+SNAPSHOT_FORMAT = 4
+
+# files the snapshot is built from
+SOURCES = [
+    'nyc-TNA.geojson',
+    'manhattan-surroundings_cleaned.csv',
+    'manhattan-crime_cleaned.csv',
+    'manhattan-rental_cleaned.csv',
+    'yelp-restaurants_cleaned.csv',
+    'yelp-food-types.csv',
+    'zipcode-centroids.csv'
+]
+
+# compact dtypes of the frames kept in memory by the app: categories for the
+# strings with few distinct values, small integers for the codes and 32-bit
+# coordinates. Columns that are not listed keep their dtype
+SCHEMA = {
+    'rental_df': {
+        'zipcode': 'category',
+        'ntacode': 'category',
+        'ntaname': 'category',
+        'type': 'category',
+        'pet': 'category',
+        'parking': 'category',
+        'laundry_code': 'int8',
+        'parking_code': 'int8',
+        'pet_code': 'int8',
+        'call_for_rent': 'int8',
+        'latitude': 'float32',
+        'longitude': 'float32'
+    },
+    'df': {
+        'ntaname': 'category',
+        'zipcode': 'category',
+        'type': 'category'
+    },
+    'facilities_db': {
+        'facgroup': 'category',
+        'zipcode': 'category',
+        'ntacode': 'category',
+        'latitude': 'float32',
+        'longitude': 'float32'
+    },
+    'crime_count': {
+        'ntaname': 'category',
+        'lat': 'float32',
+        'lon': 'float32',
+        'count': 'int32'
+    },
+    'yelp_data': {
+        'zipcode': 'category',
+        'food type': 'category',
+        'price level': 'category',
+        'outdoor seating': 'category',
+        'sit down dinning': 'category',
+        'delivery': 'category',
+        'curbside pickup': 'category',
+        'restaurant_id': 'int32'
+    }
+}
+
+def apply_schema(snapshot, schema = SCHEMA):
+    '''
+    Converts the columns of the frames in the snapshot to the dtypes in 'schema'.
+    Integer columns with missing values keep their dtype.
+
+    Parameters:
+    ----------
+        snapshot: dictionary with the dataframes (it's modified in place)
+        schema: dictionary with the dtype of each column, by frame. Default is SCHEMA
+
+    Returns:
+    --------
+    a dictionary with the memory used by each frame (in bytes) before
+    and after the conversion, e.g. {'rental_df': (before, after), ...}
+    '''
+    report = {}
+    for name, dtypes in schema.items():
+        df = snapshot[name]
+        before = int(df.memory_usage(deep = True).sum())
+        dtypes = {
+            col: dtype for col, dtype in dtypes.items()
+            if col in df and not (dtype.startswith('int') and df[col].isna().any())
+            }
+        snapshot[name] = df = df.astype(dtypes)
+        report[name] = (before, int(df.memory_usage(deep = True).sum()))
+
+    return report
+
+def memory_report(report):
+    '''
+    Prints the memory used by each frame before and after applying the schema
+    '''
+    print('Memory of the in-memory frames:')
+    for name, (before, after) in report.items():
+        print('  {:<16} {:>10,.1f} KB -> {:>10,.1f} KB'.format(name, before / 1024, after / 1024))
+    before = sum(b for b, _ in report.values())
+    after = sum(a for _, a in report.values())
+    print('  {:<16} {:>10,.1f} KB -> {:>10,.1f} KB ({:.0%} less)'.format(
+        'total', before / 1024, after / 1024, 1 - after / before if before else 0))
+
+def snapshot_version(path = '../cleaned-data/'):
+    '''
+    Returns the version of the snapshot that corresponds to the current data
+    '''
+    return '{}-{}'.format(SNAPSHOT_FORMAT, data_version([os.path.join(path, f) for f in SOURCES]))
+
+def build_snapshot(path = '../cleaned-data/'):
+    '''
+    Reads the cleaned data and runs all the transformations needed by app.py
+
+    Parameters:
+    ----------
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+
+    Returns:
+    --------
+    a dictionary with the dataframes and lists used by app.py
+    '''
+    import geopandas as gpd
+
+    # read the data
+    nyc_ntas = read_geo_cleaned('nyc-TNA.geojson', path)
+    facilities_db = read_cleaned('manhattan-surroundings_cleaned.csv', path)
+    facilities_db = facilities_db.drop_duplicates()
+    crime_geom = read_cleaned('manhattan-crime_cleaned.csv', path)
+    rental_df = read_cleaned('manhattan-rental_cleaned.csv', path)
+    yelp_data = read_cleaned('yelp-restaurants_cleaned.csv', path)
+
+    # some data transformations for more convenience
+    # --- rental data ---
+    # create a dataframe with latitude and longitude for rental zipcodes
+    # (from the table built by the cleaning scripts, see storage.build_zipcode_table)
+    zipcodes = list(rental_df['zipcode'].unique())
+    zipcodes_lat_lon = read_zipcode_table(zipcodes, path)
+    # the version is computed once the table of centroids is complete
+    # (read_zipcode_table adds the missing zipcodes to it), otherwise the next
+    # start would see a different version and build the snapshot again
+    version = snapshot_version(path)
+
+    # select all vars that refer to rental types
+    rental_types = [col for col in rental_df if 'Bed' in col or 'Studio' in col]
+    rental_types.sort()
+    # change the dataframe format from wide to long
+    rental_df = rental_df.melt(
+        id_vars = [col for col in rental_df if col not in rental_types],
+        var_name = 'type',
+        value_name = 'price'
+    )
+    # add a variable 'call for rent' when the rental price is not available
+    rental_df['call_for_rent'] = rental_df['price'].apply(lambda x: 1 if x == 'Call for Rent' else 0)
+    # change the price to float format
+    rental_df['price'] = rental_df['price'].apply(lambda x: np.nan if x == 'Call for Rent' else x).astype(float)
+    # remove rows where price is zero
+    rental_df = rental_df[rental_df['price'] != 0]
+    # append latitude and longitude
+    rental_df = rental_df.merge(right = zipcodes_lat_lon, on = 'zipcode')
+    # append ntacode and ntaname from shape file of NYC
+    rental_df = gpd.GeoDataFrame(
+        rental_df,
+        geometry = gpd.points_from_xy(
+            rental_df.longitude,
+            rental_df.latitude
+            )
+    )
+    rental_df.crs = {'init': 'epsg:4326'}
+    rental_df = gpd.sjoin(
+        left_df = rental_df,
+        right_df = nyc_ntas[['geometry', 'ntacode', 'ntaname']],
+        how = 'inner'
+    )
+    # the geometry is not needed anymore
+    rental_df = pd.DataFrame(rental_df.drop(columns = ['geometry', 'index_right']))
+    # select the columns that will be displayed in the datatable
+    cols = ['ntaname', 'zipcode', 'name', 'address', 'contact', 'rating', 'type', 'price']
+    df = rental_df[cols].sort_values(by = ['price', 'rating'], ascending = [True, False])
+
+    # --- yelp data ---
+    # the food types of each restaurant, in a long table built by yelp_scrape_clean.py
+    # (for older data that doesn't have it, it's built here)
+    if 'restaurant_id' in yelp_data and os.path.isfile(os.path.join(path, 'yelp-food-types.csv')):
+        food_types = read_cleaned('yelp-food-types.csv', path)
+    else:
+        yelp_data['restaurant_id'] = np.arange(len(yelp_data))
+        food_types = None
+    # remove duplicate columns
+    yelp_data = yelp_data.drop(columns = ['Outdoor seating'])
+    # remove duplicate rows
+    yelp_data = yelp_data.drop_duplicates(subset = ['names'])
+    if food_types is None:
+        food_types = explode_food_types(yelp_data)
+    # merge the food types with the original data
+    # a new row for each restaurant will be created for each food type
+    yelp_data = yelp_data.merge(food_types, on = 'restaurant_id')
+    # keep only the address
+    yelp_data['locations'] = yelp_data['locations'].apply(lambda x: x.split('\n')[0])
+    # rename some columns
+    yelp_data = yelp_data.rename(
+        columns = {'names':'restaurant name', 'locations': 'business address', 'ratings': 'rating'})
+    # change all names to lowercase
+    yelp_data.columns = yelp_data.columns.str.lower()
+
+    # --- crime data ---
+    # create crime counts for plots
+    crime_count = crime_geom.groupby(['ntaname', 'latitude', 'longitude']).size().to_frame('count').reset_index()
+    crime_count = crime_count.sort_values(by = 'count', ascending = False).reset_index(drop = True)
+    crime_count = crime_count.rename(columns = {'latitude':'lat', 'longitude':'lon'})
+
+    # --- surroundings data ---
+    # distances between rental zipcodes and facilities. The table is built by
+    # rental_scrape_clean.py; it's rebuilt here only if it's missing or outdated
+    proximity_file = os.path.join(path, 'zipcode-proximity.csv')
+    sources = [os.path.join(path, f) for f in ['manhattan-surroundings_cleaned.csv', 'manhattan-rental_cleaned.csv']]
+    if os.path.isfile(proximity_file) and all(os.path.getmtime(proximity_file) >= os.path.getmtime(f) for f in sources):
+        proximity_df = read_cleaned('zipcode-proximity.csv', path)
+    else:
+        proximity_df = build_proximity_table(zipcodes_lat_lon, facilities_db, index = FacilityIndex(facilities_db))
+        write_cleaned(proximity_df, 'zipcode-proximity.csv', path)
+
+    snapshot = {
+        'version': version,
+        'rental_df': rental_df,
+        'df': df,
+        'rental_types': rental_types,
+        'zipcodes_lat_lon': zipcodes_lat_lon,
+        'facilities_db': facilities_db,
+        'proximity_df': proximity_df,
+        # the crimes themselves are not kept, only their counts
+        'crime_cube': CrimeCube(crime_geom),
+        'crime_count': crime_count,
+        'yelp_data': yelp_data,
+        'zipcodes': sorted(list(rental_df['zipcode'].unique())),
+        'facilities': sorted(list(facilities_db['facgroup'].unique()))
+    }
+    # the frames are stored (and kept in memory by the app) with compact dtypes
+    snapshot['memory'] = apply_schema(snapshot)
+
+    return snapshot
+
+def save_snapshot(snapshot, path = '../cleaned-data/'):
+    '''
+    Saves the snapshot into path/serving-snapshot.pkl
+    '''
+    filename = os.path.join(path, 'serving-snapshot.pkl')
+    with open(filename + '.tmp', 'wb') as f:
+        pickle.dump(snapshot, f, protocol = pickle.HIGHEST_PROTOCOL)
+    os.replace(filename + '.tmp', filename)
+
+def load_snapshot(path = '../cleaned-data/', rebuild = False):
+    '''
+    Loads the snapshot saved in path/serving-snapshot.pkl. If it doesn't exist,
+    it's outdated or 'rebuild' is True, the snapshot is built and saved first.
+
+    Parameters:
+    ----------
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+        rebuild: whether to build the snapshot even if it's up to date
+
+    Returns:
+    --------
+    a dictionary with the dataframes and lists used by app.py
+    '''
+    filename = os.path.join(path, 'serving-snapshot.pkl')
+
+    if not rebuild and os.path.isfile(filename):
+        try:
+            with open(filename, 'rb') as f:
+                snapshot = pickle.load(f)
+            if snapshot.get('version') == snapshot_version(path):
+                return snapshot
+        except Exception:
+            pass
+
+    snapshot = build_snapshot(path)
+    save_snapshot(snapshot, path)
+
+    return snapshot
+
+if __name__ == "__main__":
+    snapshot = load_snapshot(rebuild = True)
+    print('Serving snapshot {} saved'.format(snapshot['version']))
+    memory_report(snapshot['memory'])
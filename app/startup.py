@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+@authors: Maria Lara C (mlaracue), Mengyao Xu (mengyaox) and Lu Zhang (luzhang3)
+
+This module measures how long app.py takes to start. The startup is split in
+stages (importing libraries, loading the snapshot, building the indexes, etc.)
+and, for each one, the profiler records the time it took and the modules
+that were imported during it. The report is printed when the app is ready,
+so slow imports or data loads are easy to spot.
+
+The budget (in seconds) can be set with the environment variable
+STARTUP_BUDGET; a warning is printed when the startup takes longer.
+
+Imported by: app.py
+"""
+from contextlib import contextmanager
+import time
+import sys
+import os
+
+# kinds of stages that count towards the startup budget. Other kinds (e.g. the
+# pop-up window, that waits for the user, or the data refresh) are reported
+# but not counted
+BUDGET_KINDS = ('import', 'data')
+
+class StartupProfiler:
+    '''
+    Records the time spent in each stage of the startup of the app
+
+    Parameters:
+    ----------
+        budget: maximum startup time in seconds (None means no budget).
+                Default is the value of the environment variable STARTUP_BUDGET
+    '''
+    def __init__(self, budget = None):
+        if budget is None and os.environ.get('STARTUP_BUDGET'):
+            budget = float(os.environ['STARTUP_BUDGET'])
+        self.budget = budget
+        self.stages = []
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name, kind = 'data'):
+        '''
+        Times the code run inside the 'with' block
+
+        Parameters:
+        ----------
+            name: name of the stage (e.g. 'load snapshot')
+            kind: 'import', 'data' or any other label. Only 'import' and
+                  'data' stages count towards the budget. Default is 'data'
+        '''
+        before = set(sys.modules)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            # top-level packages imported for the first time during the stage
+            packages = sorted({m.split('.')[0] for m in set(sys.modules) - before})
+            self.stages.append({'name': name, 'kind': kind, 'seconds': seconds, 'packages': packages})
+
+    def total(self, kinds = BUDGET_KINDS):
+        '''
+        Returns the time (in seconds) spent in the stages of the given kinds
+        '''
+        return sum(s['seconds'] for s in self.stages if s['kind'] in kinds)
+
+    def report(self, file = None):
+        '''
+        Prints the time spent in each stage, the total by kind and,
+        if there is a budget, whether the startup stayed within it
+        '''
+        file = file if file is not None else sys.stdout
+        print('Startup profile:', file = file)
+        for s in self.stages:
+            packages = ', '.join(s['packages'][:8]) + (', ...' if len(s['packages']) > 8 else '')
+            print('  {:<28} {:<8} {:>8.3f}s  {}'.format(
+                s['name'], s['kind'], s['seconds'], packages), file = file)
+
+        kinds = []
+        for s in self.stages:
+            if s['kind'] not in kinds:
+                kinds.append(s['kind'])
+        for kind in kinds:
+            print('  {:<28} {:<8} {:>8.3f}s'.format('total', kind, self.total([kind])), file = file)
+        print('  {:<37} {:>8.3f}s'.format('wall time', time.perf_counter() - self._start), file = file)
+
+        if self.budget is not None:
+            total = self.total()
+            if total > self.budget:
+                print('WARNING: startup took {:.3f}s, over the budget of {:.3f}s'.format(total, self.budget), file = file)
+            else:
+                print('Startup took {:.3f}s (budget {:.3f}s)'.format(total, self.budget), file = file)
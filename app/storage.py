@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+@authors: Maria Lara C (mlaracue), Mengyao Xu (mengyaox) and Lu Zhang (luzhang3)
+
+This module reads and writes the files stored in ./cleaned-data/. Every file
+has a columnar copy (Feather format) in ./cleaned-data/cache/ that can be
+loaded without parsing the csv (or geojson) file again. The copy is rebuilt
+whenever the source file changes, and if pyarrow is not installed the
+source files are read directly.
+
+Imported by: snapshot.py, cache.py, rental_scrape_clean.py, yelp_scrape_clean.py
+"""
+import pandas as pd
+import pickle
+import json
+import io
+import os
+
+try:
+    import pyarrow.feather as feather
+except ImportError:
+    feather = None
+
+# default folder of the cleaned data
+PATH = '../cleaned-data/'
+
+# smallest frame serialized in a columnar format by frame_to_bytes
+# (for smaller frames, the metadata makes it larger than a pickle)
+COLUMNAR_MIN_ROWS = 1000
+
+# arguments used to parse each csv file
+READ_OPTIONS = {
+    'manhattan-surroundings_cleaned.csv': {'dtype': {'zipcode':str}},
+    'manhattan-crime_cleaned.csv': {'parse_dates': ['datetime']},
+    'manhattan-rental_cleaned.csv': {'dtype': {'zipcode':str}},
+    'yelp-restaurants_cleaned.csv': {'dtype': {'Zipcode':str}},
+    'yelp-food-types.csv': {'dtype': {'restaurant_id':'int32', 'food type':'category'}},
+    'zipcode-proximity.csv': {'dtype': {'zipcode':str}},
+    'zipcode-centroids.csv': {'dtype': {'zipcode':str}}
+}
+
+def _cache_file(filename, path):
+    return os.path.join(path, 'cache', os.path.splitext(filename)[0] + '.feather')
+
+def _signature(source):
+    stat = os.stat(source)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def _manifest_file(path):
+    return os.path.join(path, 'cache', 'manifest.json')
+
+def _read_manifest(path):
+    try:
+        with open(_manifest_file(path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(path, filename, entry):
+    manifest = _read_manifest(path)
+    manifest[filename] = entry
+    tmp = _manifest_file(path) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, _manifest_file(path))
+
+def _is_fresh(filename, path):
+    '''
+    Returns the manifest entry of 'filename' if its cached copy was
+    built from the current version of the source file (None otherwise)
+    '''
+    source = os.path.join(path, filename)
+    entry = _read_manifest(path).get(filename)
+    if entry is None or not os.path.isfile(_cache_file(filename, path)):
+        return None
+    if entry.get('source') != _signature(source):
+        return None
+
+    return entry
+
+def _write_cache(df, filename, path, **entry):
+    '''
+    Writes the columnar copy of 'df'. Returns False if it couldn't be written
+    '''
+    if feather is None:
+        return False
+    try:
+        os.makedirs(os.path.join(path, 'cache'), exist_ok = True)
+        cache = _cache_file(filename, path)
+        feather.write_feather(df.reset_index(drop = True), cache + '.tmp')
+        os.replace(cache + '.tmp', cache)
+        _write_manifest(path, filename, dict(entry, source = _signature(os.path.join(path, filename))))
+    except Exception:
+        # columns that can't be stored in a columnar format (e.g. lists)
+        return False
+
+    return True
+
+def read_cleaned(filename, path = PATH):
+    '''
+    Reads a csv file of the cleaned data through its columnar copy.
+    The copy is (re)built if it's missing or outdated.
+
+    Parameters:
+    ----------
+        filename: name of the csv file (e.g. 'manhattan-rental_cleaned.csv')
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+
+    Returns:
+    --------
+    pandas dataframe
+    '''
+    if _is_fresh(filename, path) is not None:
+        try:
+            return feather.read_table(_cache_file(filename, path), memory_map = True).to_pandas()
+        except Exception:
+            pass
+
+    df = pd.read_csv(os.path.join(path, filename), **READ_OPTIONS.get(filename, {}))
+    _write_cache(df, filename, path)
+
+    return df
+
+def write_cleaned(df, filename, path = PATH):
+    '''
+    Saves a dataframe of the cleaned data as a csv file and
+    refreshes its columnar copy
+
+    Parameters:
+    ----------
+        df: pandas dataframe
+        filename: name of the csv file (e.g. 'manhattan-rental_cleaned.csv')
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+    '''
+    os.makedirs(path, exist_ok = True)
+    df.to_csv(os.path.join(path, filename), index = False)
+    # the copy is built from the csv file, so it's identical to what read_cleaned would return
+    df = pd.read_csv(os.path.join(path, filename), **READ_OPTIONS.get(filename, {}))
+    _write_cache(df, filename, path)
+
+def read_geo_cleaned(filename, path = PATH):
+    '''
+    Reads a geojson file of the cleaned data through its columnar copy,
+    where the geometries are stored in binary (WKB) format.
+    The copy is (re)built if it's missing or outdated.
+
+    Parameters:
+    ----------
+        filename: name of the geojson file (e.g. 'nyc-TNA.geojson')
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+
+    Returns:
+    --------
+    geopandas GeoDataFrame
+    '''
+    import geopandas as gpd
+    from shapely import wkb
+
+    entry = _is_fresh(filename, path)
+    if entry is not None:
+        try:
+            df = feather.read_table(_cache_file(filename, path), memory_map = True).to_pandas()
+            geometry = df.pop('geometry').apply(wkb.loads)
+            return gpd.GeoDataFrame(df, geometry = list(geometry), crs = entry.get('crs'))
+        except Exception:
+            pass
+
+    gdf = gpd.read_file(os.path.join(path, filename), driver = "GeoJSON")
+    df = pd.DataFrame(gdf.drop(columns = 'geometry'))
+    df['geometry'] = gdf['geometry'].apply(lambda g: g.wkb)
+    crs = gdf.crs if isinstance(gdf.crs, (dict, str)) or gdf.crs is None else gdf.crs.to_string()
+    _write_cache(df, filename, path, crs = crs)
+
+    return gdf
+
+def frame_to_bytes(df):
+    '''
+    Serializes a dataframe into a compact binary form: Feather with LZ4
+    compression or, for small frames (or if pyarrow is not installed or the
+    frame can't be stored in a columnar format), a pickle. The index is not kept.
+    '''
+    if feather is not None and len(df) >= COLUMNAR_MIN_ROWS:
+        try:
+            buffer = io.BytesIO()
+            feather.write_feather(df.reset_index(drop = True), buffer, compression = 'lz4')
+            return b'F' + buffer.getvalue()
+        except Exception:
+            pass
+
+    return b'P' + pickle.dumps(df.reset_index(drop = True), protocol = pickle.HIGHEST_PROTOCOL)
+
+def frame_from_bytes(data):
+    '''
+    Returns the dataframe serialized by frame_to_bytes
+    '''
+    if data[:1] == b'F':
+        return feather.read_feather(io.BytesIO(data[1:]))
+
+    return pickle.loads(data[1:])
+
+def _query_postal_codes(zipcodes):
+    '''
+    Looks up the centroid of each zipcode in the US postal database (pgeocode).
+    The database is downloaded the first time, so it needs network access
+    '''
+    import pgeocode
+
+    zipcodes_lat_lon = pgeocode.Nominatim('us').query_postal_code(list(zipcodes))
+    zipcodes_lat_lon = zipcodes_lat_lon[['postal_code', 'latitude', 'longitude']]
+    zipcodes_lat_lon = zipcodes_lat_lon.rename(columns = {'postal_code':'zipcode'})
+    zipcodes_lat_lon['zipcode'] = list(zipcodes)
+
+    return zipcodes_lat_lon
+
+def build_zipcode_table(zipcodes, path = PATH):
+    '''
+    Adds the centroid (latitude and longitude) of the given zipcodes to the
+    table path/zipcode-centroids.csv, which is used instead of pgeocode when
+    the app starts. Zipcodes that are already in the table are not queried again.
+
+    Parameters:
+    ----------
+        zipcodes: list of zipcodes (strings or integers)
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+
+    Returns:
+    --------
+    pandas dataframe with the columns zipcode, latitude and longitude
+    '''
+    zipcodes = sorted(set(str(z) for z in zipcodes if pd.notna(z)))
+
+    if os.path.isfile(os.path.join(path, 'zipcode-centroids.csv')):
+        table = read_cleaned('zipcode-centroids.csv', path)
+    else:
+        table = pd.DataFrame({'zipcode': [], 'latitude': [], 'longitude': []})
+
+    missing = [z for z in zipcodes if z not in set(table['zipcode'])]
+    if missing:
+        table = pd.concat([table, _query_postal_codes(missing)], ignore_index = True)
+        table = table.sort_values(by = 'zipcode').reset_index(drop = True)
+        write_cleaned(table, 'zipcode-centroids.csv', path)
+
+    return table
+
+def read_zipcode_table(zipcodes, path = PATH):
+    '''
+    Returns the centroid of each zipcode from the table built by
+    build_zipcode_table. Only zipcodes missing from the table are
+    looked up with pgeocode (if it fails, their coordinates are missing).
+
+    Parameters:
+    ----------
+        zipcodes: list of zipcodes (strings)
+        path: folder of the cleaned data. Default is '../cleaned-data/'
+
+    Returns:
+    --------
+    pandas dataframe with the columns zipcode, latitude and longitude
+    (one row per zipcode, in the same order)
+    '''
+    try:
+        table = read_cleaned('zipcode-centroids.csv', path)
+    except OSError:
+        table = pd.DataFrame({'zipcode': [], 'latitude': [], 'longitude': []})
+
+    zipcodes_lat_lon = pd.DataFrame({'zipcode': list(zipcodes)}).merge(table, on = 'zipcode', how = 'left')
+
+    missing = [z for z in zipcodes if z not in set(table['zipcode'])]
+    if missing:
+        try:
+            table = build_zipcode_table(missing, path)
+            zipcodes_lat_lon = pd.DataFrame({'zipcode': list(zipcodes)}).merge(table, on = 'zipcode', how = 'left')
+        except Exception as e:
+            print('Coordinates not found for zipcodes {}: {}'.format(', '.join(missing), e))
+
+    return zipcodes_lat_lon
@@ -12,7 +12,10 @@ This code contains two parts:
             Our Yelp data will containt the following attributes:
             'names', 'ratings', 'num_rating', 'locations', 'price level',
             'food types', 'Zipcode', 'Phone_Numer', 'Outdoor Seating',
-            'Sit down Dinning', 'Outdoor seating', 'Delivery', 'Curbside pickup'
+            'Sit down Dinning', 'Outdoor seating', 'Delivery', 'Curbside pickup',
+            'restaurant_id'
+            The food types are also stored in a long table, with a row
+            for each restaurant ('restaurant_id') and food type ('food type')
 
 Imported by: app.py
 """
@@ -276,5 +279,17 @@ lower_manhattan_rest_clean['Curbside pickup'] = ['Yes' if  'Curbside pickup, YES
 lower_manhattan_rest_clean = lower_manhattan_rest_clean.drop('covid_updates', axis =1)
 lower_manhattan_rest_clean = lower_manhattan_rest_clean.drop('services', axis =1)
 
-# save the cleaned data for recommendation algorithm to use
-lower_manhattan_rest_clean.to_csv(r'..\cleaned-data\yelp-restaurants_cleaned.csv', index = False)
+# 10. an integer id for each restaurant, used to link it to its food types
+lower_manhattan_rest_clean = lower_manhattan_rest_clean.reset_index(drop = True)
+lower_manhattan_rest_clean['restaurant_id'] = lower_manhattan_rest_clean.index
+
+# 11. a long table with a row for each restaurant and food type
+from myfuncs import explode_food_types
+yelp_food_types = explode_food_types(lower_manhattan_rest_clean)
+
+# save the cleaned data for recommendation algorithm to use (along with its columnar copy)
+from storage import write_cleaned, build_zipcode_table
+write_cleaned(lower_manhattan_rest_clean, 'yelp-restaurants_cleaned.csv')
+write_cleaned(yelp_food_types, 'yelp-food-types.csv')
+# add the zipcodes of the restaurants to the table of zipcode centroids
+build_zipcode_table(lower_manhattan_rest_clean['Zipcode'])
@@ -12,8 +12,13 @@ Therefore, it's not imported by any module
 import pandas    as pd 
 import geopandas as gpd
 from sodapy      import Socrata
+import sys
 import os
 
+# the cleaned files (and their columnar copies) are saved with app/storage.py
+sys.path.append('./app')
+from storage     import write_cleaned
+
 # checking if directory exists. If not, is created
 path = './cleaned-data/'
 if not os.path.exists(path):
@@ -68,7 +73,7 @@ crime_geom = gpd.sjoin(left_df = gdf_crime, right_df = nyc_ntas[['geometry', 'nt
 crime_geom.drop(columns = ['index_right', 'geometry'], inplace = True)
 # save the results into a csv file
 print("Saving crime data into " + path + "...")
-crime_geom.to_csv(path + 'manhattan-crime_cleaned.csv', index = False)
+write_cleaned(crime_geom, 'manhattan-crime_cleaned.csv', path)
 
 # --- restaurants data ---
 print("Making the request of 10,000 records for restaurants data")
@@ -133,4 +138,4 @@ facilities_db = facilities_db.rename(columns = {'nta': 'ntacode'})
 facilities_db = pd.concat([facilities_db, restaurants_geom], axis = 0)
 # save the results into a data frame and then into a csv file
 print("Saving surroundings data into " + path + "...")
-facilities_db.to_csv(path + 'manhattan-surroundings_cleaned.csv', index = False)
\ No newline at end of file
+write_cleaned(facilities_db, 'manhattan-surroundings_cleaned.csv', path)
\ No newline at end of file
@@ -0,0 +1,9 @@
+# -*- coding: utf-8 -*-
+"""
+The modules of the app import each other by name (they are run from ./app/),
+so the folder is added to the path before the tests import them
+"""
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
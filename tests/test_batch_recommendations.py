@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the recommendations for many profiles at once (myfuncs.batch_recommendations):
+each profile must get the same ordering as get_ordering
+"""
+import pandas as pd
+import numpy  as np
+import pytest
+
+from myfuncs import batch_recommendations, build_proximity_table, compute_distances, filter_rentals, get_ordering
+
+ZIPCODES = ['10001', '10002', '10003', '10025', '10027']
+TYPES = ['1 Bed', 'Studio']
+
+@pytest.fixture(scope = 'module')
+def data():
+    rng = np.random.default_rng(0)
+    centroids = pd.DataFrame({
+        'zipcode': ZIPCODES,
+        'latitude': [40.750, 40.715, 40.732, 40.799, 40.812],
+        'longitude': [-73.997, -73.986, -73.987, -73.966, -73.953]
+        })
+    n = 600
+    rental_df = pd.DataFrame({
+        'zipcode': rng.choice(ZIPCODES, n),
+        'type': rng.choice(TYPES, n),
+        'price': rng.integers(1000, 6000, n).astype(float),
+        'laundry_code': rng.integers(0, 2, n),
+        'parking_code': rng.integers(0, 2, n),
+        'pet_code': rng.integers(0, 2, n)
+        }).merge(centroids, on = 'zipcode')
+    m = 1500
+    facilities = pd.DataFrame({
+        'latitude': rng.uniform(40.70, 40.82, m),
+        'longitude': rng.uniform(-74.01, -73.94, m),
+        'facgroup': rng.choice(['Health care', 'Transportation', 'Parks', 'Schools'], m),
+        'zipcode': rng.choice(ZIPCODES, m)
+        })
+    return rental_df, facilities, build_proximity_table(centroids, facilities)
+
+def profile(facilities, zipcodes = ZIPCODES, price_range = (0, 30000), laundry = 0):
+    return {
+        'price_range': list(price_range),
+        'zipcodes': list(zipcodes),
+        'rental_types': TYPES,
+        'laundry': laundry,
+        'parking': 0,
+        'pets': 0,
+        'facilities': facilities
+        }
+
+def expected_ordering(p, rental_df, facilities, miles):
+    filtered_df = filter_rentals(
+        p['price_range'], p['zipcodes'], p['rental_types'], p['laundry'], p['parking'], p['pets'], df = rental_df)
+    ranks = {f: i + 1 for i, f in enumerate(p['facilities'])}
+    rentals = rental_df[rental_df['zipcode'].isin(set(filtered_df['zipcode']))]
+    distances_df = compute_distances(
+        rentals, facilities[facilities['facgroup'].isin(ranks.keys())], ranks, miles = miles)
+    return get_ordering(distances_df, n_ranks = max(ranks.values()))
+
+PROFILES = [
+    profile(['Health care', 'Transportation', 'Parks']),
+    profile(['Parks', 'Schools']),
+    profile(['Schools', 'Health care', 'Parks', 'Transportation'], zipcodes = ['10001', '10027']),
+    profile(['Transportation'], zipcodes = ['10002']),
+    # no rentals match the profile
+    profile(['Health care'], price_range = (0, 10)),
+    profile(['Parks'], laundry = 7)
+]
+
+@pytest.mark.parametrize('use_table', [True, False])
+def test_each_profile_matches_get_ordering(data, use_table):
+    rental_df, facilities, table = data
+    result = batch_recommendations(
+        PROFILES, rental_df, facilities, table = table if use_table else None, miles = 0.25)
+
+    assert result == [expected_ordering(p, rental_df, facilities, 0.25) for p in PROFILES]
+    assert result[-1] is None and result[-2] is None
+    assert all(len(r) > 1 for r in result[:3])
+
+def test_no_profile_matches(data):
+    rental_df, facilities, table = data
+    profiles = [profile(['Health care'], price_range = (0, 10)), profile(['Parks'], laundry = 7)]
+
+    assert batch_recommendations(profiles, rental_df, facilities, table = table) == [None, None]
+
+def test_no_facilities_nearby(data):
+    rental_df, facilities, table = data
+    far = facilities.assign(latitude = facilities['latitude'] + 1)
+
+    assert batch_recommendations(PROFILES[:2], rental_df, far, miles = 0.25) == [None, None]
+
+def test_no_profiles(data):
+    rental_df, facilities, table = data
+    assert batch_recommendations([], rental_df, facilities, table = table) == []
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the radius queries of the spatial index of facilities (myfuncs.FacilityIndex)
+"""
+import pandas as pd
+import numpy  as np
+import pytest
+
+from myfuncs import FacilityIndex, haversine
+
+@pytest.fixture
+def facilities():
+    rng = np.random.default_rng(0)
+    n = 2000
+    return pd.DataFrame({
+        'latitude': rng.uniform(40.70, 40.88, n),
+        'longitude': rng.uniform(-74.02, -73.91, n),
+        'facgroup': rng.choice(['Health care', 'Transportation', 'Parks'], n)
+        # the index of the dataframe is not a range
+        }, index = np.arange(n) * 3 + 7)
+
+def brute_force(lat, lon, facilities, miles):
+    pairs = []
+    for i, (la, lo) in enumerate(zip(lat, lon)):
+        d = haversine(la, lo, facilities['latitude'].to_numpy(), facilities['longitude'].to_numpy())
+        for j in np.flatnonzero(d <= miles):
+            pairs.append((i, facilities.index[j], d[j]))
+    return pairs
+
+@pytest.mark.parametrize('miles', [0.1, 0.25, 0.6])
+def test_query_radius_matches_brute_force(facilities, miles):
+    rng = np.random.default_rng(1)
+    lat = rng.uniform(40.71, 40.87, 50)
+    lon = rng.uniform(-74.01, -73.92, 50)
+
+    points, places, distances = FacilityIndex(facilities).query_radius(lat, lon, miles)
+    expected = brute_force(lat, lon, facilities, miles)
+
+    assert list(zip(points, places)) == [(i, j) for i, j, _ in expected]
+    np.testing.assert_allclose(distances, [d for _, _, d in expected])
+
+def test_query_radius_skips_missing_coordinates(facilities):
+    points, places, distances = FacilityIndex(facilities).query_radius([np.nan, 40.75], [-73.98, np.nan], 0.5)
+    assert len(points) == len(places) == len(distances) == 0
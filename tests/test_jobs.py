@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the background jobs (jobs.JobManager), whose state is stored
+on disk so any worker can answer the polls
+"""
+import threading
+
+import pytest
+
+from jobs import JobManager, JobLimitError
+
+STAGES = ['filter', 'order']
+
+def wait(manager, job_id):
+    manager.executor.shutdown(wait = True)
+
+    return manager.status(job_id)
+
+def test_other_worker_collects_the_result(tmp_path):
+    manager = JobManager(path = str(tmp_path))
+    job_id = manager.submit('s', lambda report: report('filter') or [1, 'a'], STAGES)
+    assert wait(manager, job_id)['state'] == 'done'
+
+    # a second manager on the same folder plays the role of another worker
+    other = JobManager(path = str(tmp_path))
+    status = other.collect(job_id)
+    assert status['state'] == 'done' and status['progress'] == 100
+    assert status['result'] == [1, 'a']
+
+    assert manager.collect(job_id)['state'] == 'collected'
+    assert 'result' not in other.collect(job_id)
+
+def test_result_is_collected_once(tmp_path):
+    manager = JobManager(path = str(tmp_path))
+    job_id = manager.submit('s', lambda report: 42, STAGES)
+    wait(manager, job_id)
+
+    barrier = threading.Barrier(8)
+    collected = []
+    def poll():
+        barrier.wait()
+        collected.append(manager.collect(job_id))
+    threads = [threading.Thread(target = poll) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    states = sorted(status['state'] for status in collected)
+    assert states == ['collected'] * 7 + ['done']
+    assert [status['result'] for status in collected if status['state'] == 'done'] == [42]
+
+def test_progress_and_errors(tmp_path):
+    manager = JobManager(path = str(tmp_path))
+    started, release = threading.Event(), threading.Event()
+    def func(report):
+        report('filter')
+        started.set()
+        release.wait()
+        raise ValueError('boom')
+
+    job_id = manager.submit('s', func, STAGES)
+    started.wait()
+    status = manager.collect(job_id)
+    assert status == {'state': 'running', 'stage': 'order', 'progress': 50, 'error': None}
+    with pytest.raises(JobLimitError):
+        manager.submit('s', func, STAGES)
+
+    release.set()
+    assert wait(manager, job_id)['state'] == 'error'
+    status = manager.collect(job_id)
+    assert status['state'] == 'error' and status['error'] == 'boom' and status['result'] is None
+    assert manager.collect(job_id)['state'] == 'collected'
+
+def test_unknown_job(tmp_path):
+    assert JobManager(path = str(tmp_path)).collect('missing') is None
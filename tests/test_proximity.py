@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the precomputed proximity table (myfuncs.build_proximity_table
+and myfuncs.query_proximity)
+"""
+import pandas as pd
+import numpy  as np
+import pytest
+
+from myfuncs import build_proximity_table, query_proximity, compute_distances
+
+RANKS = {'Health care': 1, 'Transportation': 2}
+
+@pytest.fixture
+def facilities():
+    rng = np.random.default_rng(0)
+    n = 500
+    return pd.DataFrame({
+        'latitude': rng.uniform(40.70, 40.80, n),
+        'longitude': rng.uniform(-74.00, -73.93, n),
+        'facgroup': rng.choice(['Health care', 'Transportation', 'Parks'], n),
+        'zipcode': rng.choice(['10001', '10002'], n)
+        })
+
+@pytest.fixture
+def zipcodes_lat_lon():
+    return pd.DataFrame({
+        'zipcode': ['10001', '10002', '10003'],
+        'latitude': [40.72, 40.75, 40.78],
+        'longitude': [-73.99, -73.97, -73.95]
+        })
+
+def sort(distances_df):
+    return distances_df.sort_values(by = ['zipcode_x', 'place_index']).reset_index(drop = True)
+
+def test_query_matches_compute_distances(facilities, zipcodes_lat_lon):
+    table = build_proximity_table(zipcodes_lat_lon, facilities, max_miles = 0.5)
+    result = query_proximity(table, facilities, ['10001', '10003'], RANKS, miles = 0.25, max_miles = 0.5)
+    expected = compute_distances(
+        zipcodes_lat_lon[zipcodes_lat_lon['zipcode'].isin(['10001', '10003'])],
+        facilities[facilities['facgroup'].isin(RANKS.keys())],
+        RANKS,
+        miles = 0.25
+        )
+
+    assert len(result) > 0
+    pd.testing.assert_frame_equal(sort(result), sort(expected)[result.columns], check_dtype = False)
+
+def test_query_beyond_the_table_radius(facilities, zipcodes_lat_lon):
+    table = build_proximity_table(zipcodes_lat_lon, facilities, max_miles = 0.5)
+    with pytest.raises(ValueError):
+        query_proximity(table, facilities, ['10001'], RANKS, miles = 0.75, max_miles = 0.5)
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the index used to filter the rentals (myfuncs.RentalIndex): it must
+return the same rentals as filter_rentals scanning the whole dataframe
+"""
+import pandas as pd
+import numpy  as np
+import pytest
+
+from myfuncs import RentalIndex, filter_rentals
+
+ZIPCODES = ['10001', '10002', '10003', '10025']
+TYPES = ['1 Bed', '2 Beds', 'Studio']
+
+@pytest.fixture(scope = 'module')
+def rental_df():
+    rng = np.random.default_rng(0)
+    n = 3000
+    price = rng.integers(500, 8000, n).astype(float)
+    price[rng.random(n) < 0.1] = np.nan
+    return pd.DataFrame({
+        'name': ['listing {}'.format(i) for i in range(n)],
+        'zipcode': rng.choice(ZIPCODES, n),
+        'type': rng.choice(TYPES, n),
+        'price': price,
+        'laundry_code': rng.integers(0, 3, n),
+        'parking_code': rng.integers(0, 2, n),
+        'pet_code': rng.integers(0, 2, n)
+        })
+
+@pytest.mark.parametrize('price_range, zipcodes, rental_types, laundry, parking, pets', [
+    ([0, 30000], ZIPCODES, TYPES, 0, 0, 0),
+    ([1000, 3000], ['10001', '10025'], ['Studio'], 1, 0, 1),
+    ([2500, 2500], ZIPCODES, TYPES, 2, 1, 0),
+    ([0, 6000], '10002', '1 Bed', 1, 1, 1),
+    ([0, 30000], ['99999'], TYPES, 0, 0, 0),
+    ([0, 30000], ZIPCODES, TYPES, 5, 0, 0)
+])
+def test_index_matches_filter_rentals(rental_df, price_range, zipcodes, rental_types, laundry, parking, pets):
+    expected = filter_rentals(price_range, zipcodes, rental_types, laundry, parking, pets, df = rental_df)
+    result = filter_rentals(
+        price_range, zipcodes, rental_types, laundry, parking, pets, df = rental_df, index = RentalIndex(rental_df))
+
+    pd.testing.assert_frame_equal(result, expected)
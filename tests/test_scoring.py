@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the scoring of the recommendations (myfuncs.score_proximity and
+myfuncs.get_ordering)
+
+The timing check is a benchmark: it only runs when the environment
+variable RUN_BENCHMARKS is set, e.g. RUN_BENCHMARKS=1 python -m pytest tests
+"""
+import time
+import os
+
+import pandas as pd
+import numpy  as np
+import pytest
+
+from myfuncs import score_proximity, get_ordering
+
+GROUPS = ['Health care', 'Transportation', 'Restaurants', 'Parks']
+
+def distance_table(n_zipcodes, n_rows, seed = 0):
+    '''
+    Random distance table like the one returned by query_proximity, with
+    three ranked groups of facilities and one that was not ranked
+    '''
+    rng = np.random.default_rng(seed)
+    facgroup = rng.choice(GROUPS, n_rows)
+    return pd.DataFrame({
+        'zipcode_x': rng.choice(['100{:02d}'.format(i) for i in range(n_zipcodes)], n_rows),
+        'place_index': np.arange(n_rows),
+        'distance': rng.uniform(0.01, 1.0, n_rows),
+        'facgroup': facgroup,
+        'rank': pd.Series(facgroup).map({'Health care': 1, 'Transportation': 2, 'Restaurants': 3}).to_numpy()
+        })
+
+def reference_scores(distances_df, n_ranks):
+    '''
+    Straightforward pandas version of the index computed by score_proximity
+    '''
+    order = (
+        distances_df[distances_df['rank'].notna()]
+        .groupby(['zipcode_x', 'facgroup'], as_index = False)
+        .agg(count = ('place_index', 'count'), distance = ('distance', 'mean'), rank = ('rank', 'first'))
+        )
+    order['index'] = order['count'] / order['distance']
+
+    def min_max(x):
+        if len(x) == 1:
+            return pd.Series(100.0, index = x.index)
+        return (x - x.min()) / (x.max() - x.min()) * 100
+
+    order['index'] = order.groupby('facgroup')['index'].transform(min_max)
+    order['index'] = order['index'] * (n_ranks + 1 - order['rank']) / n_ranks
+
+    return order.groupby('zipcode_x')['index'].sum()
+
+def test_scores_match_reference():
+    distances_df = distance_table(n_zipcodes = 30, n_rows = 5000)
+    scores = score_proximity(distances_df, n_ranks = 3)
+    expected = reference_scores(distances_df, n_ranks = 3)
+
+    pd.testing.assert_series_equal(scores.sort_index(), expected.sort_index(), check_names = False)
+    # sorted from best to worst
+    assert (np.diff(scores.to_numpy()) <= 0).all()
+
+def test_ordering_is_sorted_by_score():
+    distances_df = distance_table(n_zipcodes = 10, n_rows = 1000)
+    scores = reference_scores(distances_df, n_ranks = 3)
+    ordering = get_ordering(distances_df, n_ranks = 3)
+
+    assert ordering == list(scores.sort_values(ascending = False, kind = 'mergesort').index)
+
+def test_any_number_of_ranks():
+    distances_df = distance_table(n_zipcodes = 10, n_rows = 1000)
+    distances_df['rank'] = distances_df['facgroup'].map({g: r + 1 for r, g in enumerate(GROUPS)})
+    scores = score_proximity(distances_df, n_ranks = 4)
+
+    pd.testing.assert_series_equal(
+        scores.sort_index(), reference_scores(distances_df, n_ranks = 4).sort_index(), check_names = False)
+
+def test_ordering_of_one_or_no_zipcodes():
+    distances_df = distance_table(n_zipcodes = 1, n_rows = 100)
+    assert get_ordering(distances_df) == ['10000']
+    assert get_ordering(distances_df.iloc[:0]) is None
+
+@pytest.mark.skipif(not os.environ.get('RUN_BENCHMARKS'), reason = 'set RUN_BENCHMARKS to run the benchmarks')
+def test_scoring_time():
+    # the distance table of all Manhattan rental zipcodes and the ranked
+    # facilities within walking distance (see query_proximity) has a few
+    # thousand rows; this one has 50,000
+    distances_df = distance_table(n_zipcodes = 45, n_rows = 50000)
+    timings = []
+    for _ in range(5):
+        start = time.perf_counter()
+        score_proximity(distances_df, n_ranks = 3)
+        timings.append(time.perf_counter() - start)
+
+    assert min(timings) < 0.010
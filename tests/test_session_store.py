@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the store of the intermediate results of each session
+(cache.SessionStore), which is shared by all the workers through the disk
+"""
+import os
+import time
+
+import pandas as pd
+
+from cache import SessionStore
+
+FRAMES = {
+    'filtered_df': pd.DataFrame({'zipcode': ['10001', '10002'], 'price': [1000.0, 2000.0]}),
+    'ranking': pd.DataFrame({'zipcode': ['10002', '10001']})
+    }
+
+def test_other_worker_reads_the_entry(tmp_path):
+    SessionStore(path = str(tmp_path)).put('s', 'q', FRAMES)
+
+    # a second store on the same folder plays the role of another worker
+    other = SessionStore(path = str(tmp_path))
+    frames = other.get('s', 'q')
+    assert sorted(frames) == ['filtered_df', 'ranking']
+    pd.testing.assert_frame_equal(frames['filtered_df'], FRAMES['filtered_df'])
+    assert other.get('s', 'q', names = []) == {}
+    assert list(other.get('s', 'q', names = ['ranking'])) == ['ranking']
+    assert other.get('s', 'other query') is None
+    assert other.get('other session', 'q') is None
+
+def test_entries_expire(tmp_path):
+    store = SessionStore(path = str(tmp_path), ttl = 60)
+    store.put('s', 'q', FRAMES)
+    old = time.time() - 120
+    os.utime(store.filename('s', 'q'), (old, old))
+
+    assert store.get('s', 'q') is None
+    assert len(store) == 0
+
+def test_least_recently_used_are_evicted(tmp_path):
+    store = SessionStore(path = str(tmp_path), max_entries = 2)
+    for i, query in enumerate(['a', 'b']):
+        store.put('s', query, FRAMES)
+        old = time.time() - 10 + i
+        os.utime(store.filename('s', query), (old, old))
+
+    # reading 'a' makes 'b' the least recently used entry
+    assert store.get('s', 'a', names = []) == {}
+    store.put('s', 'c', FRAMES)
+
+    assert len(store) == 2
+    assert store.get('s', 'b') is None
+    assert store.get('s', 'a') is not None
+
+def test_drop_session(tmp_path):
+    store = SessionStore(path = str(tmp_path))
+    store.put('s', 'q', FRAMES)
+    store.put('t', 'q', FRAMES)
+    store.drop_session('s')
+
+    assert store.get('s', 'q') is None
+    assert store.get('t', 'q') is not None
+    assert store.nbytes() == os.stat(store.filename('t', 'q')).st_size
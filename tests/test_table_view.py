@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the server-side paging, sorting and filtering of the DataTables
+(myfuncs.parse_filter_query and myfuncs.TableView)
+"""
+import pandas as pd
+import numpy  as np
+import pytest
+
+from myfuncs import parse_filter_query, TableView, YelpStore
+
+@pytest.fixture
+def view():
+    df = pd.DataFrame({
+        'zipcode': pd.Categorical(['10001', '10002', None, '10001']),
+        'name': ['Apt 12', 'Loft', 'Apt 3', 'Studio 12B'],
+        'price': [1200.0, np.nan, 3000.0, 2500.0]
+        })
+    return TableView(df, ['zipcode', 'name', 'price'])
+
+def test_parse_keeps_values_as_strings():
+    assert parse_filter_query('{zipcode} contains 10001 && {price} >= 2000') == [
+        ('zipcode', 'contains', '10001'),
+        ('price', 'ge', '2000')
+        ]
+
+def test_parse_removes_quotes():
+    assert parse_filter_query('{name} = "Apt 12"') == [('name', 'eq', 'Apt 12')]
+
+def test_parse_ignores_invalid_parts():
+    assert parse_filter_query('') == []
+    assert parse_filter_query('{price} >= ') == []
+
+@pytest.mark.parametrize('filter_query, expected', [
+    # numbers typed in text columns are compared as text
+    ('{zipcode} contains 10001', [0, 3]),
+    ('{zipcode} = 10001', [0, 3]),
+    ('{zipcode} = "10001"', [0, 3]),
+    ('{zipcode} != 10001', [1, 2]),
+    ('{name} contains 12', [0, 3]),
+    ('{name} contains apt', [0, 2]),
+    ('{name} datestartswith Apt', [0, 2]),
+    # numeric columns compare numbers
+    ('{price} >= 2000', [2, 3]),
+    ('{price} = 1200', [0]),
+    ('{price} contains 12', [0]),
+    ('{price} > abc', []),
+    ('{price} >= 2000 && {zipcode} = 10001', [3]),
+    # unknown columns are ignored
+    ('{rating} > 3', [0, 1, 2, 3])
+])
+def test_filter(view, filter_query, expected):
+    assert view.rows(filter_query = filter_query).tolist() == expected
+
+def test_sort_matches_pandas(view):
+    sort_by = [{'column_id': 'zipcode', 'direction': 'asc'}, {'column_id': 'price', 'direction': 'desc'}]
+    expected = view.df.sort_values(by = ['zipcode', 'price'], ascending = [True, False], kind = 'mergesort')
+    assert view.rows(sort_by).tolist() == expected.index.to_list()
+
+def test_missing_values_go_last(view):
+    for direction in ['asc', 'desc']:
+        rows = view.rows([{'column_id': 'price', 'direction': direction}])
+        assert rows[-1] == 1
+
+def test_page(view):
+    records, page_count = view.page(1, 3)
+    assert page_count == 2
+    assert [r['name'] for r in records] == ['Studio 12B']
+
+def test_page_after_the_last_one(view):
+    records, page_count = view.page(5, 3, filter_query = '{name} contains apt')
+    assert page_count == 1
+    assert [r['name'] for r in records] == ['Apt 12', 'Apt 3']
+
+def test_restaurant_table_filters_text_with_digits():
+    yelp_data = pd.DataFrame({
+        'restaurant name': ['Joe 99', 'Joe 99', 'Bar'],
+        'zipcode': ['10001', '10001', '10002'],
+        'food type': ['pizza', 'bars', 'bars'],
+        'price level': ['$', '$', '$$'],
+        'num_rating': [10, 10, 5],
+        'rating': [4.5, 4.5, 3.0],
+        'phone_number': ['(212) 555-0199', '(212) 555-0199', '(212) 555-0142']
+        })
+    store = YelpStore(yelp_data, columns = ['restaurant name', 'phone_number', 'rating'])
+
+    records, _ = store.restaurants.page(0, 5, filter_query = '{phone_number} contains 0199')
+    assert [r['restaurant name'] for r in records] == ['Joe 99']
+    records, _ = store.get('10001')['table'].page(0, 5, filter_query = '{restaurant name} contains 99')
+    assert [r['restaurant name'] for r in records] == ['Joe 99']
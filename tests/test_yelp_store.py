@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the aggregates of the Yelp data by zipcode (myfuncs.YelpStore)
+"""
+import pandas as pd
+import pytest
+
+from myfuncs import YelpStore
+
+@pytest.fixture
+def yelp_data():
+    return pd.DataFrame({
+        'restaurant name': ['a', 'b', 'c', 'd', 'e', 'f', 'g'],
+        'zipcode': ['10001'] * 6 + ['10002'],
+        'food type': ['zeta', 'alpha', 'mid', 'zeta', 'alpha', 'mid', 'beta'],
+        'price level': ['$', '$$', '$', '$', '$$', '$', '$'],
+        'num_rating': [10, 20, 30, 40, 50, 60, 70],
+        'rating': [1.0, 2.0, 3.0, 4.0, 5.0, 4.5, 3.5]
+        })
+
+@pytest.mark.parametrize('dtype', [object, 'category'])
+def test_ties_are_broken_by_name(yelp_data, dtype):
+    store = YelpStore(yelp_data.astype({'food type': dtype}), n_scatter = 2, n_bars = 2)
+    aggregates = store.get('10001')
+
+    assert aggregates['food_types']['food type'].tolist() == ['alpha', 'mid']
+    assert sorted(aggregates['scatter']['food type'].astype(str).unique()) == ['alpha', 'mid']
+
+def test_most_common_first(yelp_data):
+    yelp_data.loc[2, 'food type'] = 'zeta'
+    aggregates = YelpStore(yelp_data, n_bars = 3).get('10001')
+
+    assert aggregates['food_types']['food type'].tolist() == ['zeta', 'alpha', 'mid']
+    assert aggregates['food_types']['pct'].tolist() == pytest.approx([0.5, 2 / 6, 1 / 6])
+
+def test_zipcode_without_restaurants(yelp_data):
+    aggregates = YelpStore(yelp_data).get('99999')
+
+    assert len(aggregates['food_types']) == 0
+    assert len(aggregates['table']) == 0